@@ -0,0 +1,30 @@
+"""add_conversation_pagination_indexes
+
+Revision ID: 3e7b9f2c5a18
+Revises: 8c4f1a6e2d90
+Create Date: 2026-10-18 16:41:07.295530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e7b9f2c5a18'
+down_revision: Union[str, Sequence[str], None] = '8c4f1a6e2d90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_conversations_user_updated', 'conversations', ['user_id', 'updated_at', 'id'])
+    op.create_index('ix_messages_conversation_created', 'messages', ['conversation_id', 'created_at', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation_created', table_name='messages')
+    op.drop_index('ix_conversations_user_updated', table_name='conversations')
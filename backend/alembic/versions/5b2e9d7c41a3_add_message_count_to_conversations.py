@@ -0,0 +1,40 @@
+"""add_message_count_to_conversations
+
+Revision ID: 5b2e9d7c41a3
+Revises: fbbfbf0ad851
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e9d7c41a3'
+down_revision: Union[str, Sequence[str], None] = 'fbbfbf0ad851'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.alter_column('updated_at', server_default=sa.func.now())
+
+    # Backfill counts from the existing messages, and give never-updated conversations
+    # an updated_at so they sort correctly in the conversation list
+    op.execute(
+        "UPDATE conversations SET message_count = "
+        "(SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.id)"
+    )
+    op.execute("UPDATE conversations SET updated_at = created_at WHERE updated_at IS NULL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.alter_column('updated_at', server_default=None)
+        batch_op.drop_column('message_count')
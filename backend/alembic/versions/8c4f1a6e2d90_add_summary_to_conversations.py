@@ -0,0 +1,33 @@
+"""add_summary_to_conversations
+
+Revision ID: 8c4f1a6e2d90
+Revises: 5b2e9d7c41a3
+Create Date: 2026-10-18 14:03:52.718264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c4f1a6e2d90'
+down_revision: Union[str, Sequence[str], None] = '5b2e9d7c41a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing conversations start without a summary; it is built after their next turn
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('summary_message_count', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_column('summary_message_count')
+        batch_op.drop_column('summary')
@@ -0,0 +1,220 @@
+"""
+Precomputed advice for the first reply of a prediction conversation.
+
+Usage (from the backend directory):
+    python -m app.chatbot.catalog build --languages en si ta
+    python -m app.chatbot.catalog show
+
+The initial /chatbot/chat/prediction reply depends only on the crop, the
+predicted disease and the language, and the model knows 15 classes. The
+build command asks the LLM once per (crop, disease, language) key, using
+the same prompt and truncation as the live endpoint, and writes a
+versioned JSON catalog. The API loads it at startup and answers matching
+first turns from memory; follow-ups and unknown keys still go to the LLM.
+
+Entries are keyed by model class. Requests name the crop and disease as
+the model does ("Tomato" / "Tomato_Late_blight", i.e. /ml/predict's
+predicted_class) or in plain words ("tomato" / "late blight", "bell
+pepper" / "bacterial spot"); resolve_class maps both forms to the class.
+Names that fit several classes, such as "blight", are left to the LLM.
+
+Every entry records a fingerprint of the prompt it was generated from, so
+entries whose prompt has since changed are skipped on load instead of
+serving advice the current prompt would not produce.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+from app.ml.constants import class_names
+from .llm import create_client, prompt_fingerprint, LLMService
+from .utils import build_crop_disease_prompt, _truncate_to_one_paragraph
+
+logger = logging.getLogger(__name__)
+
+# 2: prompt_sha256 holds the full digest, the same key LLMService coalesces on
+CATALOG_FORMAT = 2
+
+
+def _norm(value: str) -> str:
+    # "Tomato_Late_blight" and "tomato late blight" are the same disease
+    return " ".join(re.findall(r"[^\s_]+", value)).casefold()
+
+
+def class_crop(class_name: str) -> str:
+    """Crop part of a model class, e.g. "Pepper__bell" for "Pepper__bell___Bacterial_spot" """
+    if "___" in class_name:
+        return class_name.split("___", 1)[0]
+    return class_name.split("_", 1)[0]
+
+
+def _class_aliases() -> Dict[Tuple[str, str], Optional[str]]:
+    """(crop, disease) spellings accepted for each class; None marks spellings shared by several classes"""
+    aliases: Dict[Tuple[str, str], Optional[str]] = {}
+    for name in class_names:
+        crop = class_crop(name)
+        crop_words = _norm(crop).split()
+        crops = {" ".join(crop_words), crop_words[0], " ".join(reversed(crop_words))}
+        disease = _norm(name[len(crop):])
+        diseases = {disease}
+        if disease.startswith(crop_words[0] + " "):
+            # "Tomato__Tomato_mosaic_virus": the class repeats the crop
+            diseases.add(disease[len(crop_words[0]) + 1:])
+        for key in ((c, d) for c in crops for d in diseases):
+            aliases[key] = name if aliases.get(key, name) == name else None
+    return aliases
+
+
+_CLASS_ALIASES = _class_aliases()
+_CLASSES_BY_NAME = {_norm(name): name for name in class_names}
+
+
+def resolve_class(crop: str, disease: str) -> Optional[str]:
+    """Model class named by a request's crop and disease, or None if unknown or ambiguous"""
+    disease = _norm(disease)
+    if disease in _CLASSES_BY_NAME:
+        # The class name already says which crop it is
+        return _CLASSES_BY_NAME[disease]
+    return _CLASS_ALIASES.get((_norm(crop), disease))
+
+
+class AdviceCatalog:
+    """In-memory (model class, language) -> advice lookup"""
+
+    def __init__(self, entries: Optional[Dict[Tuple[str, str], str]] = None, version: Optional[str] = None):
+        self.entries = entries or {}
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path: str) -> "AdviceCatalog":
+        """Load a catalog file; a missing file gives an empty catalog"""
+        if not os.path.exists(path):
+            logger.info("No advice catalog at %s; initial prediction replies use the LLM", path)
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("format") != CATALOG_FORMAT:
+            logger.warning("Ignoring advice catalog %s with unsupported format %s", path, data.get("format"))
+            return cls()
+
+        entries, stale = {}, 0
+        for entry in data["entries"]:
+            prompt = build_crop_disease_prompt(entry["disease"], entry["crop"], language=entry["language"])
+            if entry["prompt_sha256"] != prompt_fingerprint(prompt):
+                stale += 1
+                continue
+            class_name = resolve_class(entry["crop"], entry["disease"])
+            if class_name is None:
+                logger.warning("Skipping advice catalog entry for unknown class %s / %s", entry["crop"], entry["disease"])
+                continue
+            entries[(class_name, _norm(entry["language"]))] = entry["response"]
+        if stale:
+            logger.warning("Skipped %d advice catalog entries generated from an older prompt", stale)
+        logger.info("Loaded advice catalog %s: %d entries", data["version"], len(entries))
+        return cls(entries, data["version"])
+
+    def get(self, crop: str, disease: str, language: str) -> Optional[str]:
+        class_name = resolve_class(crop, disease)
+        response = self.entries.get((class_name, _norm(language))) if class_name else None
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+async def _generate_entries(llm, keys, attempts: int):
+    async def generate(crop: str, disease: str, language: str):
+        prompt = build_crop_disease_prompt(disease, crop, language=language)
+        for attempt in range(1, attempts + 1):
+            try:
+                response = _truncate_to_one_paragraph(await llm.generate(prompt))
+                break
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                logger.warning("%s / %s / %s failed (%s), retrying", crop, disease, language, e)
+                await asyncio.sleep(2 ** attempt)
+        print(f"{crop} / {disease} / {language}: {response[:60]}...")
+        return {
+            "crop": crop,
+            "disease": disease,
+            "language": language,
+            "response": response,
+            "prompt_sha256": prompt_fingerprint(prompt),
+        }
+
+    return await asyncio.gather(*(generate(*key) for key in keys))
+
+
+def build(args):
+    from app.core.config import get_settings
+
+    settings = get_settings()
+    llm = LLMService(
+        create_client(settings),
+        max_concurrency=args.concurrency,
+        timeout=settings.CHAT_LLM_TIMEOUT_SECONDS
+    )
+    keys = [(class_crop(name), name, language) for name in class_names for language in args.languages]
+    started = time.perf_counter()
+    entries = asyncio.run(_generate_entries(llm, keys, args.attempts))
+
+    catalog = {
+        "format": CATALOG_FORMAT,
+        "version": args.version or time.strftime("%Y%m%d-%H%M%S"),
+        "llm_provider": settings.CHAT_LLM_PROVIDER,
+        "llm_model": settings.CHAT_LLM_MODEL,
+        "created_at": time.time(),
+        "entries": entries,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    tmp_path = args.output + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(catalog, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, args.output)
+    print(f"Wrote {len(entries)} entries (version {catalog['version']}) to {args.output} "
+          f"in {time.perf_counter() - started:.0f}s")
+
+
+def show(args):
+    catalog = AdviceCatalog.load(args.output)
+    print(json.dumps(catalog.stats(), indent=2))
+    for (class_name, language), response in sorted(catalog.entries.items()):
+        print(f"{class_name} / {language}: {response}")
+
+
+def main():
+    from app.core.config import get_settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "show"])
+    parser.add_argument("--output", default=get_settings().CHAT_ADVICE_CATALOG_PATH, help="Catalog file")
+    parser.add_argument("--languages", nargs="+", default=["en"], help="Language codes, e.g. en si ta")
+    parser.add_argument("--version", help="Catalog version (default: a timestamp)")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM calls in flight while building")
+    parser.add_argument("--attempts", type=int, default=3, help="Tries per key before giving up")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    {"build": build, "show": show}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
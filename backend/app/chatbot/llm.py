@@ -0,0 +1,370 @@
+"""
+Async LLM client layer for the chatbot.
+LLMClient implementations talk to a provider without blocking the event
+loop. LLMService wraps a client with a per-worker concurrency limit, a
+deadline per call (covering time spent waiting for a slot), cancellation
+when the HTTP client disconnects, and call statistics for /chatbot/stats.
+Completions can also be streamed chunk by chunk under the same limits.
+
+Concurrent generate() calls with the same prompt are coalesced: the first
+starts the provider call and later ones wait for its result. The provider
+call is only abandoned once every caller waiting on it has gone.
+
+CHAT_LLM_PROVIDER selects the client: "gemini", or "local", an offline
+stand-in with a configurable latency distribution, token rate, error rate
+and streaming chunk size for load tests (see benchmarks/chatbot.py).
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMTimeoutError(LLMError):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class LLMClient:
+    name = "base"
+
+    async def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield the completion in chunks as the provider produces them"""
+        yield await self.generate(prompt)
+
+
+class GeminiClient(LLMClient):
+    """Google Gemini through google-generativeai's native async API"""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str, api_key: str):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    async def generate(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            yield chunk.text
+
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+
+# Canned answer for the local provider: four sentences and a second paragraph,
+# so the one-paragraph truncation is exercised the same way as with Gemini
+_LOCAL_SENTENCES = [
+    "This looks like a common problem that many farmers in your area face.",
+    "Check the underside of the leaves every few days and remove any that show spots or yellowing.",
+    "Use a neem oil spray in the early morning and avoid watering the leaves in the evening.",
+    "Rotate crops next season and keep the field free of plant debris.",
+    "Your local agriculture officer can also confirm the problem with a field visit.",
+]
+
+
+class LocalLLMClient(LLMClient):
+    """Offline Gemini stand-in for load testing; no network calls and no quota.
+
+    Each call waits a time-to-first-token drawn from the latency distribution
+    (median latency_ms), then produces the answer at tokens_per_second, a word
+    per token. error_rate is the share of calls that fail after the first-token
+    wait. Streams yield stream_chunk_tokens words per chunk."""
+
+    name = "local"
+
+    def __init__(
+        self,
+        latency_distribution: str = "lognormal",
+        latency_ms: float = 800.0,
+        latency_sigma: float = 0.5,
+        tokens_per_second: float = 50.0,
+        error_rate: float = 0.0,
+        stream_chunk_tokens: int = 4,
+        seed: Optional[int] = None
+    ):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown latency distribution '{latency_distribution}', expected one of {', '.join(LATENCY_DISTRIBUTIONS)}"
+            )
+        self.latency_distribution = latency_distribution
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.stream_chunk_tokens = max(1, stream_chunk_tokens)
+        self.rng = random.Random(seed)
+
+    def _first_token_seconds(self) -> float:
+        median = self.latency_ms / 1000.0
+        if self.latency_distribution == "uniform":
+            return self.rng.uniform(0.5 * median, 1.5 * median)
+        if self.latency_distribution == "lognormal":
+            return median * self.rng.lognormvariate(0.0, self.latency_sigma)
+        if self.latency_distribution == "exponential":
+            return self.rng.expovariate(1.0 / median) if median > 0 else 0.0
+        return median
+
+    def _answer(self, prompt: str) -> list:
+        # Vary the sentence order by prompt so different questions get different answers
+        offset = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16) % len(_LOCAL_SENTENCES)
+        sentences = _LOCAL_SENTENCES[offset:] + _LOCAL_SENTENCES[:offset]
+        text = " ".join(sentences[:4]) + "\n\n" + sentences[4]
+        return text.split(" ")
+
+    async def _first_token(self) -> None:
+        await asyncio.sleep(self._first_token_seconds())
+        if self.rng.random() < self.error_rate:
+            raise RuntimeError("Simulated provider error")
+
+    async def generate(self, prompt: str) -> str:
+        words = self._answer(prompt)
+        await self._first_token()
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(len(words) / self.tokens_per_second)
+        return " ".join(words)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        words = self._answer(prompt)
+        await self._first_token()
+        for start in range(0, len(words), self.stream_chunk_tokens):
+            chunk = words[start:start + self.stream_chunk_tokens]
+            if self.tokens_per_second > 0:
+                await asyncio.sleep(len(chunk) / self.tokens_per_second)
+            yield (" " if start else "") + " ".join(chunk)
+
+
+LLM_PROVIDERS = ("gemini", "local")
+
+
+def create_client(settings) -> LLMClient:
+    """Build the client selected by CHAT_LLM_PROVIDER"""
+    provider = settings.CHAT_LLM_PROVIDER
+    if provider == "gemini":
+        return GeminiClient(settings.CHAT_LLM_MODEL, settings.GENAI_API_KEY)
+    if provider == "local":
+        return LocalLLMClient(
+            latency_distribution=settings.CHAT_LOCAL_LLM_LATENCY_DISTRIBUTION,
+            latency_ms=settings.CHAT_LOCAL_LLM_LATENCY_MS,
+            latency_sigma=settings.CHAT_LOCAL_LLM_LATENCY_SIGMA,
+            tokens_per_second=settings.CHAT_LOCAL_LLM_TOKENS_PER_SECOND,
+            error_rate=settings.CHAT_LOCAL_LLM_ERROR_RATE,
+            stream_chunk_tokens=settings.CHAT_LOCAL_LLM_STREAM_CHUNK_TOKENS,
+            seed=settings.CHAT_LOCAL_LLM_SEED
+        )
+    raise ValueError(f"Unknown LLM provider '{provider}', expected one of {', '.join(LLM_PROVIDERS)}")
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # The body has already been read, so the next ASGI message is the disconnect
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def prompt_fingerprint(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """One provider call shared by every caller that asked for the same prompt"""
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class LLMService:
+    """Shared entry point for LLM calls: bounded concurrency, deadlines and cancellation"""
+
+    def __init__(self, client: LLMClient, max_concurrency: int = 256, timeout: float = 30.0, coalesce: bool = True):
+        self.client = client
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.coalesce = coalesce
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._flights: Dict[str, _Flight] = {}
+
+        # Statistics
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.coalesced = 0
+        self.provider_calls = 0
+        self._total_latency = 0.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _call(self, prompt: str) -> str:
+        semaphore = self._get_semaphore()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.provider_calls += 1
+        started = time.perf_counter()
+        try:
+            return await self.client.generate(prompt)
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+            self._total_latency += time.perf_counter() - started
+
+    def _join(self, prompt: str, timeout: float) -> _Flight:
+        """Start a provider call for prompt, or join the one already in flight"""
+        key = prompt_fingerprint(prompt) if self.coalesce else None
+        flight = self._flights.get(key) if key is not None else None
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            flight = _Flight(asyncio.ensure_future(asyncio.wait_for(self._call(prompt), timeout or None)))
+            if key is not None:
+                self._flights[key] = flight
+                flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        flight.waiters += 1
+        return flight
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _leave(self, prompt: str, flight: _Flight) -> None:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # Nobody wants the result any more; later callers must start a fresh call
+            if self.coalesce:
+                self._forget(prompt_fingerprint(prompt), flight)
+            flight.task.cancel()
+
+    async def generate(self, prompt: str, request: Optional[Request] = None, timeout: Optional[float] = None) -> str:
+        """Run one completion within the deadline; with request, abandon it if the client disconnects"""
+        timeout = self.timeout if timeout is None else timeout
+        flight = self._join(prompt, timeout)
+        watcher = asyncio.ensure_future(_wait_for_disconnect(request)) if request is not None else None
+        try:
+            if watcher is not None:
+                await asyncio.wait({flight.task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+                if not flight.task.done():
+                    self.cancelled += 1
+                    raise ClientDisconnected()
+            # Shielded so one caller being cancelled does not cancel the others' call
+            text = await asyncio.shield(flight.task)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeoutError(f"LLM call exceeded {timeout:g}s")
+        except (ClientDisconnected, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            self.failures += 1
+            logger.warning("LLM call failed: %s", e)
+            raise LLMError(str(e)) from e
+        finally:
+            self._leave(prompt, flight)
+            if watcher is not None:
+                watcher.cancel()
+        self.completed += 1
+        return text
+
+    async def stream(self, prompt: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Stream one completion within the deadline. Closing the generator early (e.g. once the
+        response is long enough) stops the provider call; cancellation counts as a disconnect."""
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout else None
+
+        def remaining() -> Optional[float]:
+            if deadline is None:
+                return None
+            left = deadline - loop.time()
+            if left <= 0:
+                raise asyncio.TimeoutError()
+            return left
+
+        semaphore = self._get_semaphore()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), remaining())
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeoutError(f"LLM call exceeded {timeout:g}s")
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        self.provider_calls += 1
+        started = time.perf_counter()
+        chunks = self.client.stream(prompt)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), remaining())
+                except StopAsyncIteration:
+                    break
+                yield chunk
+            self.completed += 1
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeoutError(f"LLM call exceeded {timeout:g}s")
+        except GeneratorExit:
+            # The consumer stopped reading because it has what it needs
+            self.completed += 1
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except Exception as e:
+            self.failures += 1
+            logger.warning("LLM stream failed: %s", e)
+            raise LLMError(str(e)) from e
+        finally:
+            await chunks.aclose()
+            self.in_flight -= 1
+            semaphore.release()
+            self._total_latency += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        calls = self.completed + self.failures + self.timeouts + self.cancelled
+        return {
+            "provider": self.client.name,
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": self.timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / calls if calls else 0.0,
+            "provider_calls": self.provider_calls,
+            "avg_latency_ms": self._total_latency / self.provider_calls * 1000.0 if self.provider_calls else 0.0,
+        }
@@ -1,169 +1,458 @@
-import google.generativeai as genai
+import asyncio
+import base64
+import json
+from datetime import datetime
+from typing import Optional
 from app.core.config import get_settings
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session, joinedload
 from app.auth.middleware import get_db
 from app.auth.middleware import get_current_user_dependency as get_current_user
+from app.db.database import SessionLocal
 from app.db.models import User, Conversation, Message
 from .utils import (
     generate_crop_disease_response, 
     generate_general_chat_response,
+    stream_crop_disease_response,
+    stream_general_chat_response,
     get_conversation_history,
-    create_conversation,
-    add_message_to_conversation
+    save_chat_turn,
+    ConversationFull,
+    MAX_MESSAGES_PER_CONVERSATION
 )
+from .llm import create_client, LLMService, LLMError, LLMTimeoutError, ClientDisconnected
+from .catalog import AdviceCatalog
+from .semantic_cache import SemanticCache, load_embedder
+from .summaries import ConversationSummarizer
+from .write_behind import MessageWriter
 from . import schemas
 
 settings = get_settings()
 
-GENAI_API_KEY = settings.GENAI_API_KEY
-genai.configure(api_key=GENAI_API_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
+# One shared client per worker (CHAT_LLM_PROVIDER); calls never block the event loop
+llm = LLMService(
+    create_client(settings),
+    max_concurrency=settings.CHAT_LLM_MAX_CONCURRENCY,
+    timeout=settings.CHAT_LLM_TIMEOUT_SECONDS,
+    coalesce=settings.CHAT_LLM_COALESCE
+)
+
+# Folds older messages into each conversation's summary after a turn
+summarizer = ConversationSummarizer(
+    llm,
+    recent_messages=settings.CHAT_HISTORY_RECENT_MESSAGES,
+    max_messages=MAX_MESSAGES_PER_CONVERSATION
+)
+
+# Queues chat messages for background batch writes when CHAT_WRITE_BEHIND_ENABLED; started by startup()
+message_writer = MessageWriter(
+    max_messages=MAX_MESSAGES_PER_CONVERSATION,
+    batch_size=settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+    retry_backoff=settings.CHAT_WRITE_BEHIND_RETRY_BACKOFF_SECONDS,
+    max_backoff=settings.CHAT_WRITE_BEHIND_MAX_BACKOFF_SECONDS,
+    max_queued_turns=settings.CHAT_WRITE_BEHIND_MAX_QUEUED_TURNS,
+    # Summaries are updated once the turn is in the database
+    on_written=summarizer.schedule
+) if settings.CHAT_WRITE_BEHIND_ENABLED else None
+
+# Precomputed first replies for prediction conversations, loaded by startup()
+advice_catalog = AdviceCatalog()
+# Answers to first-turn general questions, created by startup() when enabled
+semantic_cache = None
 
 router = APIRouter()
 
+async def startup():
+    """Load the advice catalog and the semantic cache's embedder, and start the message writer"""
+    global advice_catalog, semantic_cache
+    if message_writer is not None:
+        message_writer.start()
+    if settings.CHAT_ADVICE_CATALOG_ENABLED:
+        advice_catalog = AdviceCatalog.load(settings.CHAT_ADVICE_CATALOG_PATH)
+    if settings.CHAT_SEMANTIC_CACHE_ENABLED:
+        semantic_cache = SemanticCache(
+            load_embedder(settings.CHAT_SEMANTIC_CACHE_EMBEDDER),
+            threshold=settings.CHAT_SEMANTIC_CACHE_THRESHOLD,
+            max_entries=settings.CHAT_SEMANTIC_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.CHAT_SEMANTIC_CACHE_TTL_SECONDS
+        )
+
+async def shutdown():
+    """Write queued messages and stop pending summary updates"""
+    if message_writer is not None:
+        await message_writer.shutdown()
+    await summarizer.shutdown()
+
+async def _llm_response(generate):
+    """Await an LLM-backed generate_* call, mapping LLM failures to HTTP errors"""
+    try:
+        return await generate
+    except LLMTimeoutError:
+        raise HTTPException(status_code=504, detail="The assistant took too long to respond")
+    except ClientDisconnected:
+        # Nobody is waiting for this response any more
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except LLMError:
+        raise HTTPException(status_code=502, detail="The assistant is unavailable, please try again")
+
+def _release_connection(db: Session) -> None:
+    # Hand the pooled connection back before waiting on the LLM; otherwise concurrent chats
+    # exhaust the pool and the next checkout blocks the event loop. The session reconnects on next use.
+    db.close()
+
+async def _load_turn(db: Session, conversation_id, *filters):
+    """Return (conversation_id, history, summary) for a chat turn in one read transaction.
+    conversation_id is None for a new conversation, which is created when the turn is saved.
+    history holds only the messages the summary does not cover yet."""
+    if message_writer is not None and message_writer.backlogged:
+        # The database is not keeping up (or is down); do not answer turns that cannot be saved
+        raise HTTPException(status_code=503, detail="Chat history cannot be saved right now, please try again")
+    if not conversation_id:
+        _release_connection(db)
+        return None, [], None
+    if message_writer is not None:
+        # A batch with this conversation's turns may be committing right now
+        await message_writer.wait_written(conversation_id)
+
+    # Verify conversation belongs to user and matches the endpoint
+    conversation = db.query(
+        Conversation.message_count, Conversation.summary, Conversation.summary_message_count
+    ).filter(Conversation.id == conversation_id, *filters).first()
+
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Messages still queued for the writer count, and belong to the history, as if written
+    pending = message_writer.pending_messages(conversation_id) if message_writer is not None else []
+
+    # Enforce the per-conversation message limit
+    if conversation.message_count + len(pending) >= MAX_MESSAGES_PER_CONVERSATION:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum number of messages ({MAX_MESSAGES_PER_CONVERSATION}) reached for this conversation."
+        )
+    conversation_history = get_conversation_history(db, conversation_id, start=conversation.summary_message_count)
+    conversation_history.extend(pending)
+    _release_connection(db)
+    return conversation_id, conversation_history, conversation.summary
+
+async def _general_conversation(db: Session, current_user: User, conversation_id):
+    """Return (conversation_id, history, summary, new conversation fields) for a general chat turn"""
+    conversation_id, conversation_history, summary = await _load_turn(
+        db,
+        conversation_id,
+        Conversation.user_id == current_user.id,
+        Conversation.conversation_type == "general"
+    )
+    new_conversation = {"user_id": current_user.id, "conversation_type": "general"}
+    return conversation_id, conversation_history, summary, new_conversation
+
+async def _prediction_conversation(db: Session, current_user: User, request: schemas.PredictionRequest):
+    """Return (conversation_id, history, summary, new conversation fields) for a prediction chat turn"""
+    conversation_id, conversation_history, summary = await _load_turn(
+        db,
+        request.conversation_id,
+        Conversation.user_id == current_user.id,
+        Conversation.conversation_type == "prediction",
+        Conversation.crop == request.crop,
+        Conversation.disease == request.disease
+    )
+    new_conversation = {
+        "user_id": current_user.id,
+        "conversation_type": "prediction",
+        "crop": request.crop,
+        "disease": request.disease,
+    }
+    return conversation_id, conversation_history, summary, new_conversation
+
+def _summarize_later(conversation_id) -> None:
+    # A new conversation holds a single turn, so there is nothing to fold yet.
+    # With write-behind the writer schedules the update once the turn is written.
+    if conversation_id is not None and message_writer is None:
+        summarizer.schedule(conversation_id)
+
+def _save_turn(db: Session, conversation_id, user_message: str, response: str, new_conversation: dict) -> int:
+    try:
+        saved_id = save_chat_turn(db, conversation_id, user_message, response, new_conversation, message_writer)
+        _summarize_later(conversation_id)
+        return saved_id
+    except ConversationFull:
+        # Another turn filled the conversation while this one was waiting on the LLM
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum number of messages ({MAX_MESSAGES_PER_CONVERSATION}) reached for this conversation."
+        )
+
+def _prediction_user_message(request: schemas.PredictionRequest) -> str:
+    # Follow-ups store the question; the initial prediction stores what was detected
+    if request.follow_up_message:
+        return request.follow_up_message
+    return f"Detected {request.disease} in {request.crop}"
+
+async def _cached_answer(message: str):
+    """Look up a first-turn question in the semantic cache; returns (answer or None, vector)"""
+    if semantic_cache is None:
+        return None, None
+    embedder = semantic_cache.embedder
+    vector = await asyncio.to_thread(embedder.embed, message) if embedder.offload else embedder.embed(message)
+    hit = semantic_cache.get(message, vector)
+    return (hit[0] if hit else None), vector
+
+async def _single_delta(text: str):
+    yield text
+
+async def _cache_on_completion(deltas, message: str, vector):
+    """Pass deltas through and cache the full answer if the stream completes"""
+    parts = []
+    try:
+        async for delta in deltas:
+            parts.append(delta)
+            yield delta
+    finally:
+        await deltas.aclose()
+    semantic_cache.put(message, "".join(parts), vector)
+
+def _sse(data: dict, event: str = None) -> str:
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+def _sse_response(deltas, conversation_id, user_message: str, new_conversation: dict) -> StreamingResponse:
+    """Stream an LLM response as Server-Sent Events and persist the turn once it completes.
+
+    Events: "meta" with the conversation_id (null for a new conversation), unnamed
+    {"delta": ...} text events, then "done" with the full response and conversation_id,
+    or "error" if the LLM call fails. Nothing is saved if the client disconnects or the call fails."""
+    async def events():
+        yield _sse({"conversation_id": conversation_id}, event="meta")
+        parts = []
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                yield _sse({"delta": delta})
+        except LLMTimeoutError:
+            yield _sse({"status": 504, "detail": "The assistant took too long to respond"}, event="error")
+            return
+        except LLMError:
+            yield _sse({"status": 502, "detail": "The assistant is unavailable, please try again"}, event="error")
+            return
+        finally:
+            await deltas.aclose()
+
+        response = "".join(parts)
+        # The request's session is not guaranteed to outlive the handler, so use a fresh one
+        db = SessionLocal()
+        try:
+            saved_id = save_chat_turn(db, conversation_id, user_message, response, new_conversation, message_writer)
+        except ConversationFull:
+            detail = f"Maximum number of messages ({MAX_MESSAGES_PER_CONVERSATION}) reached for this conversation."
+            yield _sse({"status": 400, "detail": detail}, event="error")
+            return
+        finally:
+            db.close()
+        _summarize_later(conversation_id)
+        yield _sse({"response": response, "conversation_id": saved_id}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/chat", response_model=schemas.ChatResponse)
 async def chat_with_bot(
     request: schemas.ChatRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """General chat endpoint with conversation memory"""
     
-    # Get conversation history if conversation_id is provided
-    conversation_history = []
-    conversation_id = request.conversation_id
-    
-    if conversation_id:
-        # Verify conversation belongs to user
-        conversation = db.query(Conversation).filter(
-            Conversation.id == conversation_id,
-            Conversation.user_id == current_user.id,
-            Conversation.conversation_type == "general"
-        ).first()
-        
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-        
-        conversation_history = get_conversation_history(db, conversation_id)
-        # Enforce max 5 messages per conversation
-        if len(conversation_history) >= 5:
-            raise HTTPException(status_code=400, detail="Maximum number of messages (5) reached for this conversation.")
-    else:
-        # Create new conversation
-        conversation = create_conversation(db, current_user.id, "general")
-        conversation_id = conversation.id
+    conversation_id, conversation_history, summary, new_conversation = await _general_conversation(
+        db, current_user, request.conversation_id
+    )
     
-    # Generate response
-    response = generate_general_chat_response(request.message, model, conversation_history)
+    # Generate response; a first question may already have been answered for someone else
+    response, vector = (None, None) if request.conversation_id else await _cached_answer(request.message)
+    if response is None:
+        response = await _llm_response(generate_general_chat_response(
+            request.message, llm, conversation_history, request=http_request, summary=summary
+        ))
+        if vector is not None:
+            semantic_cache.put(request.message, response, vector)
     
     # Save user message and bot response
-    add_message_to_conversation(db, conversation_id, "user", request.message)
-    add_message_to_conversation(db, conversation_id, "assistant", response)
+    conversation_id = _save_turn(db, conversation_id, request.message, response, new_conversation)
     
     return schemas.ChatResponse(response=response, conversation_id=conversation_id)
 
+@router.post("/chat/stream")
+async def chat_with_bot_stream(
+    request: schemas.ChatRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Streaming variant of /chat: the response is sent as Server-Sent Events"""
+    conversation_id, conversation_history, summary, new_conversation = await _general_conversation(
+        db, current_user, request.conversation_id
+    )
+    cached, vector = (None, None) if request.conversation_id else await _cached_answer(request.message)
+    if cached is not None:
+        deltas = _single_delta(cached)
+    else:
+        deltas = stream_general_chat_response(request.message, llm, conversation_history, summary)
+        if vector is not None:
+            deltas = _cache_on_completion(deltas, request.message, vector)
+    return _sse_response(deltas, conversation_id, request.message, new_conversation)
+
 @router.post("/chat/prediction", response_model=schemas.PredictionResponse)
 async def chat_prediction(
     request: schemas.PredictionRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Prediction chat endpoint with conversation memory"""
     
-    conversation_history = []
-    conversation_id = request.conversation_id
-    
-    if conversation_id:
-        # Verify conversation belongs to user and is a prediction conversation
-        conversation = db.query(Conversation).filter(
-            Conversation.id == conversation_id,
-            Conversation.user_id == current_user.id,
-            Conversation.conversation_type == "prediction",
-            Conversation.crop == request.crop,
-            Conversation.disease == request.disease
-        ).first()
-        
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-        
-        conversation_history = get_conversation_history(db, conversation_id)
-        # Enforce max 5 messages per conversation
-        if len(conversation_history) >= 5:
-            raise HTTPException(status_code=400, detail="Maximum number of messages (5) reached for this conversation.")
-    else:
-        # Create new prediction conversation
-        conversation = create_conversation(
-            db, 
-            current_user.id, 
-            "prediction", 
-            crop=request.crop, 
-            disease=request.disease
-        )
-        conversation_id = conversation.id
+    conversation_id, conversation_history, summary, new_conversation = await _prediction_conversation(
+        db, current_user, request
+    )
     
     # Generate response
     if request.follow_up_message:
         # This is a follow-up question
-        response = generate_crop_disease_response(
+        response = await _llm_response(generate_crop_disease_response(
             request.disease, 
             request.crop, 
-            model, 
-            conversation_history
-        )
-        # Save the follow-up message
-        add_message_to_conversation(db, conversation_id, "user", request.follow_up_message)
+            llm, 
+            conversation_history,
+            request=http_request,
+            language=request.language,
+            summary=summary
+        ))
     else:
-        # This is the initial prediction
-        response = generate_crop_disease_response(request.disease, request.crop, model)
-        # Save the initial query
-        add_message_to_conversation(db, conversation_id, "user", f"Detected {request.disease} in {request.crop}")
+        # This is the initial prediction; the catalog answers known diseases without an LLM call
+        response = advice_catalog.get(request.crop, request.disease, request.language)
+        if response is None:
+            response = await _llm_response(generate_crop_disease_response(
+                request.disease, request.crop, llm, request=http_request, language=request.language
+            ))
     
-    # Save bot response
-    add_message_to_conversation(db, conversation_id, "assistant", response)
+    # Save the user's message and bot response
+    conversation_id = _save_turn(db, conversation_id, _prediction_user_message(request), response, new_conversation)
     
     return schemas.PredictionResponse(response=response, conversation_id=conversation_id)
 
-@router.get("/conversations", response_model=list[schemas.ConversationResponse])
+@router.post("/chat/prediction/stream")
+async def chat_prediction_stream(
+    request: schemas.PredictionRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Streaming variant of /chat/prediction: the response is sent as Server-Sent Events"""
+    conversation_id, conversation_history, summary, new_conversation = await _prediction_conversation(
+        db, current_user, request
+    )
+    cached = None if request.follow_up_message else advice_catalog.get(request.crop, request.disease, request.language)
+    if cached is not None:
+        deltas = _single_delta(cached)
+    else:
+        deltas = stream_crop_disease_response(
+            request.disease,
+            request.crop,
+            llm,
+            conversation_history if request.follow_up_message else None,
+            language=request.language,
+            summary=summary if request.follow_up_message else None
+        )
+    return _sse_response(deltas, conversation_id, _prediction_user_message(request), new_conversation)
+
+def _encode_cursor(timestamp: datetime, row_id: int) -> str:
+    payload = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def _before_cursor(timestamp_column, id_column, cursor: str):
+    """Keyset filter for rows that sort after the cursor in (timestamp, id) descending order"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(payload)
+        timestamp, row_id = datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return or_(timestamp_column < timestamp, and_(timestamp_column == timestamp, id_column < row_id))
+
+def _chat_message(msg: Message) -> schemas.ChatMessage:
+    return schemas.ChatMessage(role=msg.role, content=msg.content, created_at=msg.created_at)
+
+def _conversation_fields(conv: Conversation) -> dict:
+    return {
+        "id": conv.id,
+        "conversation_type": conv.conversation_type,
+        "crop": conv.crop,
+        "disease": conv.disease,
+        "created_at": conv.created_at,
+        "updated_at": conv.updated_at,
+    }
+
+@router.get("/conversations", response_model=schemas.ConversationPage)
 async def get_user_conversations(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    summary: bool = False,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all conversations for the current user"""
-    conversations = db.query(Conversation).filter(
-        Conversation.user_id == current_user.id
-    ).order_by(Conversation.updated_at.desc()).all()
-    
-    result = []
-    for conv in conversations:
-        messages = db.query(Message).filter(Message.conversation_id == conv.id).order_by(Message.created_at).all()
-        chat_messages = [
-            schemas.ChatMessage(
-                role=msg.role,
-                content=msg.content,
-                created_at=msg.created_at
-            ) for msg in messages
+    """Get the current user's conversations, most recently updated first, one page per request.
+
+    Each page is a single query. With summary=true only the message count and last
+    message of each conversation are returned instead of the full history."""
+    query = db.query(Conversation).filter(Conversation.user_id == current_user.id)
+    if cursor:
+        query = query.filter(_before_cursor(Conversation.updated_at, Conversation.id, cursor))
+    query = query.order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+
+    if summary:
+        # Messages of a turn share a timestamp, so the highest id is the last message
+        last_message_id = select(func.max(Message.id)).where(
+            Message.conversation_id == Conversation.id
+        ).correlate(Conversation).scalar_subquery()
+        rows = query.outerjoin(Message, Message.id == last_message_id).add_entity(Message).limit(limit + 1).all()
+        conversations = [conv for conv, _ in rows]
+        items = [
+            schemas.ConversationSummary(
+                **_conversation_fields(conv),
+                message_count=conv.message_count,
+                last_message=_chat_message(last) if last is not None else None
+            ) for conv, last in rows[:limit]
         ]
-        
-        result.append(schemas.ConversationResponse(
-            id=conv.id,
-            conversation_type=conv.conversation_type,
-            crop=conv.crop,
-            disease=conv.disease,
-            created_at=conv.created_at,
-            updated_at=conv.updated_at,
-            messages=chat_messages
-        ))
-    
-    return result
+    else:
+        conversations = query.options(joinedload(Conversation.messages)).limit(limit + 1).all()
+        items = [
+            schemas.ConversationResponse(
+                **_conversation_fields(conv),
+                messages=[_chat_message(msg) for msg in conv.messages]
+            ) for conv in conversations[:limit]
+        ]
+
+    next_cursor = None
+    if len(conversations) > limit:
+        last = conversations[limit - 1]
+        next_cursor = _encode_cursor(last.updated_at, last.id)
+    return schemas.ConversationPage(conversations=items, next_cursor=next_cursor)
 
 @router.get("/conversations/{conversation_id}", response_model=schemas.ConversationResponse)
 async def get_conversation(
     conversation_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get a specific conversation with all its messages"""
+    """Get a specific conversation with its latest messages, in conversation order.
+    Older messages are fetched by passing older_messages_cursor back as cursor."""
     conversation = db.query(Conversation).filter(
         Conversation.id == conversation_id,
         Conversation.user_id == current_user.id
@@ -172,21 +461,29 @@ async def get_conversation(
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    messages = db.query(Message).filter(Message.conversation_id == conversation_id).order_by(Message.created_at).all()
-    chat_messages = [
-        schemas.ChatMessage(
-            role=msg.role,
-            content=msg.content,
-            created_at=msg.created_at
-        ) for msg in messages
-    ]
+    query = db.query(Message).filter(Message.conversation_id == conversation_id)
+    if cursor:
+        query = query.filter(_before_cursor(Message.created_at, Message.id, cursor))
+    messages = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1).all()
+
+    older_messages_cursor = None
+    if len(messages) > limit:
+        oldest = messages[limit - 1]
+        older_messages_cursor = _encode_cursor(oldest.created_at, oldest.id)
     
     return schemas.ConversationResponse(
-        id=conversation.id,
-        conversation_type=conversation.conversation_type,
-        crop=conversation.crop,
-        disease=conversation.disease,
-        created_at=conversation.created_at,
-        updated_at=conversation.updated_at,
-        messages=chat_messages
-    )
\ No newline at end of file
+        **_conversation_fields(conversation),
+        messages=[_chat_message(msg) for msg in reversed(messages[:limit])],
+        older_messages_cursor=older_messages_cursor
+    )
+
+@router.get("/stats")
+async def chatbot_stats():
+    """LLM call concurrency, latency and failure statistics"""
+    return {
+        "llm": llm.stats(),
+        "advice_catalog": advice_catalog.stats(),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+        "summaries": summarizer.stats(),
+        "write_behind": message_writer.stats() if message_writer is not None else None
+    }
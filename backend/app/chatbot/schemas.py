@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Union
 from datetime import datetime
 
 class ChatMessage(BaseModel):
@@ -15,6 +15,21 @@ class ConversationResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     messages: List[ChatMessage]
+    older_messages_cursor: Optional[str] = None  # Pass as cursor to get the messages before these
+
+class ConversationSummary(BaseModel):
+    id: int
+    conversation_type: str
+    crop: Optional[str] = None
+    disease: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    message_count: int
+    last_message: Optional[ChatMessage] = None
+
+class ConversationPage(BaseModel):
+    conversations: List[Union[ConversationResponse, ConversationSummary]]
+    next_cursor: Optional[str] = None  # Pass as cursor to get the next page
 
 class ChatRequest(BaseModel):
     message: str
@@ -29,6 +44,7 @@ class PredictionRequest(BaseModel):
     disease: str
     conversation_id: Optional[int] = None
     follow_up_message: Optional[str] = None
+    language: str = "en"
 
 class PredictionResponse(BaseModel):
     response: str
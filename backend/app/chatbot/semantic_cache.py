@@ -0,0 +1,200 @@
+"""
+Semantic cache of answers to first-turn general chat questions.
+
+A first message to /chatbot/chat has no history, so its answer depends only
+on the question. Questions are normalized and embedded; a new question is
+answered from the cache when its cosine similarity to a cached one reaches
+the threshold. The default embedder hashes word and character 3-gram
+features of the question's content words (stopwords dropped, plurals
+folded) into a fixed-size vector, so "How can I improve soil fertility?"
+and "improve fertility of soil" match while "pesticide for tomato" and
+"pesticide for potato" do not. A sentence-transformers model can be used
+instead when that package is installed.
+
+Vectors live in one preallocated matrix, so a lookup is a single
+matrix-vector product over at most max_entries rows.
+"""
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Function words that do not change what is being asked. Question words that do
+# ("when", "where", "why") and negations are kept.
+_STOPWORDS = frozenset(
+    "a an the is are was were be been am to of for in on at by with from and or "
+    "how what which can could should would will do does did i my me we our us you your "
+    "it its this that these those there please tell give some any".split()
+)
+_TOKEN = re.compile(r"[\w']+")
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(_TOKEN.findall(text.casefold()))
+
+
+def _fold(word: str) -> str:
+    # Fold plurals so "tomatoes" and "tomato" are the same term
+    if len(word) > 4:
+        if word.endswith("ies"):
+            return word[:-3] + "y"
+        if word.endswith("oes") or word.endswith("ses"):
+            return word[:-2]
+        if word.endswith("s") and not word.endswith("ss"):
+            return word[:-1]
+    return word
+
+
+def question_terms(text: str) -> list:
+    return [_fold(word) for word in normalize_question(text).split() if word not in _STOPWORDS]
+
+
+class HashingEmbedder:
+    """Signed feature hashing of content words and their character 3-grams"""
+
+    name = "hashing"
+    offload = False
+
+    def __init__(self, dim: int = 4096, char_weight: float = 0.25):
+        self.dim = dim
+        self.char_weight = char_weight
+
+    def _features(self, terms):
+        for term in terms:
+            yield "w:" + term, 1.0
+            padded = f"<{term}>"
+            for i in range(len(padded) - 2):
+                yield "c:" + padded[i:i + 3], self.char_weight
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        terms = question_terms(text) or normalize_question(text).split()
+        for feature, weight in self._features(terms):
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dim] += weight if h & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SentenceTransformerEmbedder:
+    """Small local sentence embedding model (needs the sentence-transformers package)"""
+
+    offload = True  # Model inference is too slow for the event loop
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.name = model_name
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.model.encode(normalize_question(text), normalize_embeddings=True).astype(np.float32)
+
+
+def load_embedder(name: str):
+    """"hashing", or a sentence-transformers model name; falls back to hashing if that cannot load"""
+    if name == "hashing":
+        return HashingEmbedder()
+    try:
+        return SentenceTransformerEmbedder(name)
+    except Exception as e:
+        logger.warning("Could not load embedding model %s (%s); using the hashing embedder", name, e)
+        return HashingEmbedder()
+
+
+class SemanticCache:
+    """Bounded LRU of question -> answer with TTL, matched by embedding similarity"""
+
+    def __init__(self, embedder, threshold: float = 0.9, max_entries: int = 1024, ttl_seconds: float = 86400.0):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl_seconds
+
+        # normalized question -> slot; rows of _vectors/_expires_at/_answers are slots
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        self._vectors = np.zeros((self.max_entries, embedder.dim), dtype=np.float32)
+        self._expires_at = np.full(self.max_entries, -np.inf)
+        self._answers = [None] * self.max_entries
+        self._keys = [None] * self.max_entries
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _release(self, key: str) -> None:
+        slot = self._slots.pop(key)
+        self._expires_at[slot] = -np.inf
+        self._answers[slot] = None
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def get(self, question: str, vector: Optional[np.ndarray] = None) -> Optional[Tuple[str, float]]:
+        """Return (answer, similarity) for the closest live cached question, if close enough"""
+        now = time.monotonic()
+        key = normalize_question(question)
+        slot = self._slots.get(key)
+        if slot is not None:
+            if self._expires_at[slot] < now:
+                self._release(key)
+                self.expirations += 1
+            else:
+                self._slots.move_to_end(key)
+                self.hits += 1
+                return self._answers[slot], 1.0
+
+        if self._slots:
+            if vector is None:
+                vector = self.embedder.embed(question)
+            similarities = self._vectors @ vector
+            similarities[self._expires_at < now] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self._slots.move_to_end(self._keys[best])
+                self.semantic_hits += 1
+                return self._answers[best], float(similarities[best])
+        self.misses += 1
+        return None
+
+    def put(self, question: str, answer: str, vector: Optional[np.ndarray] = None) -> None:
+        key = normalize_question(question)
+        if key in self._slots:
+            self._release(key)
+        while not self._free:
+            self._release(next(iter(self._slots)))
+            self.evictions += 1
+        slot = self._free.pop()
+        self._vectors[slot] = self.embedder.embed(question) if vector is None else vector
+        self._expires_at[slot] = time.monotonic() + self.ttl
+        self._answers[slot] = answer
+        self._keys[slot] = key
+        self._slots[key] = slot
+
+    def clear(self) -> None:
+        for key in list(self._slots):
+            self._release(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "embedder": self.embedder.name,
+            "size": len(self._slots),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
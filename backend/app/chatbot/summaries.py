@@ -0,0 +1,143 @@
+"""
+Rolling conversation summaries.
+
+Prompts are built from a conversation's summary plus the messages it does
+not cover yet, so their size stays flat however long the conversation
+gets. After each saved turn a background task folds every message older
+than the last CHAT_HISTORY_RECENT_MESSAGES into the summary with one LLM
+call. Conversation.summary_message_count records how many messages the
+summary covers; if a fold is still running or has failed, the next turn
+simply sees more unsummarized messages, trimmed to the prompt budget.
+
+A full conversation (CHAT_MAX_MESSAGES_PER_CONVERSATION) takes no more
+turns, so it is never summarized. When the limit leaves no room for more
+than the recent messages, as with the defaults, summaries are not needed
+at all and the summarizer stays idle.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import update
+
+from app.db.database import SessionLocal
+from app.db.models import Conversation
+from .llm import LLMError, LLMService
+from .utils import get_conversation_history
+
+logger = logging.getLogger(__name__)
+
+
+def build_summary_prompt(summary: Optional[str], messages: List[dict]) -> str:
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    current = f"Summary so far:\n{summary}\n\n" if summary else ""
+    return f"""
+You keep a running summary of a conversation between a rural farmer and an agriculture expert chatbot.
+{current}New messages:
+{transcript}
+
+Write an updated summary that will be used as context for the rest of the conversation.
+Keep the crops, diseases, symptoms, advice already given and anything the farmer said about their situation.
+Use at most 120 words of plain text.
+"""
+
+
+class ConversationSummarizer:
+    """Updates Conversation.summary in background tasks, at most one per conversation at a time"""
+
+    def __init__(self, llm: LLMService, recent_messages: int = 4, max_messages: Optional[int] = None):
+        self.llm = llm
+        self.recent_messages = max(0, recent_messages)
+        self.max_messages = max_messages
+        # A summary is only read by a later turn, which needs more than the recent messages before the limit
+        self.enabled = max_messages is None or max_messages - 1 > self.recent_messages
+        if not self.enabled:
+            logger.info(
+                "Conversation summaries disabled: the %d recent messages already cover every turn "
+                "a conversation can hold (%d messages)", self.recent_messages, max_messages
+            )
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+        # Statistics
+        self.updates = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def schedule(self, conversation_id: int) -> None:
+        """Fold older messages into the summary after a turn has been saved"""
+        if not self.enabled:
+            return
+        if conversation_id in self._tasks:
+            # The running update re-checks the counts when it finishes
+            self.skipped += 1
+            return
+        task = asyncio.get_running_loop().create_task(self._run(conversation_id))
+        self._tasks[conversation_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(conversation_id, None))
+
+    async def _run(self, conversation_id: int) -> None:
+        # Loop so turns saved while the LLM was summarizing are folded in too
+        while await self._update(conversation_id):
+            pass
+
+    async def _update(self, conversation_id: int) -> bool:
+        """Fold one batch of messages into the summary; returns True if anything changed"""
+        db = SessionLocal()
+        try:
+            conversation = db.query(
+                Conversation.summary, Conversation.summary_message_count, Conversation.message_count
+            ).filter(Conversation.id == conversation_id).first()
+            if conversation is None:
+                return False
+            if self.max_messages is not None and conversation.message_count >= self.max_messages:
+                # No further turn can use the summary
+                return False
+            covered = conversation.summary_message_count
+            fold_until = conversation.message_count - self.recent_messages
+            if fold_until <= covered:
+                return False
+            messages = get_conversation_history(db, conversation_id, start=covered, limit=fold_until - covered)
+            db.close()  # No connection held while the LLM runs
+
+            try:
+                summary = (await self.llm.generate(build_summary_prompt(conversation.summary, messages))).strip()
+            except LLMError as e:
+                self.failures += 1
+                logger.warning("Could not summarize conversation %s: %s", conversation_id, e)
+                return False
+
+            # Only apply if nobody else moved the summary on in the meantime
+            result = db.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id, Conversation.summary_message_count == covered)
+                .values(summary=summary, summary_message_count=fold_until)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            if result.rowcount:
+                self.updates += 1
+            return bool(result.rowcount)
+        except Exception:
+            db.rollback()
+            self.failures += 1
+            logger.exception("Summary update failed for conversation %s", conversation_id)
+            return False
+        finally:
+            db.close()
+
+    async def shutdown(self) -> None:
+        """Cancel pending summary updates; they are redone after the next turn"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "recent_messages": self.recent_messages,
+            "pending": len(self._tasks),
+            "updates": self.updates,
+            "failures": self.failures,
+            "skipped": self.skipped,
+        }
@@ -1,33 +1,117 @@
-from typing import List, Optional
+import re
+from typing import AsyncIterator, List, Optional
+from app.core.config import get_settings
 from app.db.models import Conversation, Message
+from sqlalchemy import func, insert, update
 from sqlalchemy.orm import Session
+from starlette.requests import Request
+from .llm import LLMService
+from .write_behind import MessageWriter
+
+settings = get_settings()
+
+# Turns are refused once a conversation holds this many messages
+MAX_MESSAGES_PER_CONVERSATION = settings.CHAT_MAX_MESSAGES_PER_CONVERSATION
+
+class ConversationFull(Exception):
+    pass
 
 def _truncate_to_one_paragraph(text: str) -> str:
     # Truncate at first double line break or after 3 sentences
-    import re
     # Try to split at double line break
     para = text.split("\n\n", 1)[0].strip()
     # If still too long, split into sentences
     sentences = re.split(r'(?<=[.!?]) +', para)
     return ' '.join(sentences[:3]).strip()
 
-def generate_crop_disease_response(disease, crop, model, conversation_history: Optional[List[dict]] = None):
-    if conversation_history:
-        # Build conversation context from history
-        context = f"Previous conversation about {disease} in {crop}:\n"
-        for msg in conversation_history:
-            context += f"{msg['role']}: {msg['content']}\n"
+class ParagraphLimiter:
+    """Incremental _truncate_to_one_paragraph for streamed responses.
+    feed() returns the new text that is certain to be part of the final answer,
+    and sets done once the paragraph or sentence limit has been reached."""
+
+    def __init__(self):
+        self.raw = ""
+        self.text = ""
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        self.raw += chunk
+        para = self.raw.split("\n\n", 1)[0]
+        # A fourth split means the third sentence has ended, whatever comes next
+        if "\n\n" in self.raw or len(re.split(r'(?<=[.!?]) +', para.lstrip())) > 3:
+            self.done = True
+        candidate = _truncate_to_one_paragraph(self.raw)
+        if not candidate.startswith(self.text):
+            return ""
+        delta, self.text = candidate[len(self.text):], candidate
+        return delta
+
+async def stream_one_paragraph(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Yield the truncated response as it arrives, closing the LLM stream once the limit is hit"""
+    limiter = ParagraphLimiter()
+    try:
+        async for chunk in chunks:
+            delta = limiter.feed(chunk)
+            if delta:
+                yield delta
+            if limiter.done:
+                break
+    finally:
+        await chunks.aclose()
+
+# Language codes accepted by the prediction chat; other values are passed to the LLM as given
+LANGUAGE_NAMES = {"en": "English", "si": "Sinhala", "ta": "Tamil"}
+
+def _language_instruction(language: str) -> str:
+    if language == "en":
+        return ""
+    return f"Respond in {LANGUAGE_NAMES.get(language, language)}.\n"
+
+def _estimate_tokens(text: str) -> int:
+    # Roughly four characters per token; close enough to budget prompts without a tokenizer
+    return len(text) // 4 + 1
+
+def _history_context(
+    heading: str,
+    conversation_history: Optional[List[dict]],
+    summary: Optional[str] = None,
+    token_budget: Optional[int] = None
+) -> str:
+    """Summary of earlier turns plus the newest messages that fit in the token budget"""
+    if token_budget is None:
+        token_budget = settings.CHAT_HISTORY_TOKEN_BUDGET
+    summary_line = f"Summary of earlier conversation: {summary}\n" if summary else ""
+    remaining = token_budget - _estimate_tokens(summary_line)
+    lines = []
+    # Walk back from the newest message; the latest one is always kept
+    for msg in reversed(conversation_history or []):
+        line = f"{msg['role']}: {msg['content']}\n"
+        remaining -= _estimate_tokens(line)
+        if lines and remaining < 0:
+            break
+        lines.append(line)
+    return heading + summary_line + "".join(reversed(lines))
+
+def build_crop_disease_prompt(
+    disease,
+    crop,
+    conversation_history: Optional[List[dict]] = None,
+    language: str = "en",
+    summary: Optional[str] = None
+) -> str:
+    if conversation_history or summary:
+        # Build conversation context from the summary and recent history
+        context = _history_context(f"Previous conversation about {disease} in {crop}:\n", conversation_history, summary)
         
-        prompt = f"""
+        return f"""
 {context}
 
 Continue the conversation about {disease} in {crop}. The user is asking a follow-up question.
 Please provide a helpful, supportive response that builds on the previous conversation.
 Keep the tone clear, supportive, and practical for a rural farmer.
 Limit your response to a single paragraph (max 3 sentences).
-"""
-    else:
-        prompt = f"""
+{_language_instruction(language)}"""
+    return f"""
 You are an agriculture expert chatbot helping a rural farmer.
 The AI system has detected "{disease}" in their "{crop}" plant.
 
@@ -38,19 +122,18 @@ Please give a simple response in one paragraph (max 3 sentences):
 - Friendly message in local context (short)
 
 Keep the tone clear, supportive, and practical.
-"""
-    
-    response = model.generate_content(prompt)
-    return _truncate_to_one_paragraph(response.text)
-
-def generate_general_chat_response(message: str, model, conversation_history: Optional[List[dict]] = None):
-    if conversation_history:
-        # Build conversation context from history
-        context = "Previous conversation:\n"
-        for msg in conversation_history:
-            context += f"{msg['role']}: {msg['content']}\n"
+{_language_instruction(language)}"""
+
+def build_general_chat_prompt(
+    message: str,
+    conversation_history: Optional[List[dict]] = None,
+    summary: Optional[str] = None
+) -> str:
+    if conversation_history or summary:
+        # Build conversation context from the summary and recent history
+        context = _history_context("Previous conversation:\n", conversation_history, summary)
         
-        prompt = f"""
+        return f"""
 {context}
 
 User: {message}
@@ -59,8 +142,7 @@ You are an agriculture expert chatbot helping rural farmers. Continue the conver
 Provide practical, supportive advice related to farming, crops, weather, or any agricultural concerns.
 Keep responses clear, friendly, and actionable for rural farmers.
 Limit your response to a single paragraph (max 3 sentences)."""
-    else:
-        prompt = f"""
+    return f"""
 You are an agriculture expert chatbot helping rural farmers.
 
 User: {message}
@@ -68,40 +150,113 @@ User: {message}
 Provide practical, supportive advice related to farming, crops, weather, or any agricultural concerns.
 Keep responses clear, friendly, and actionable for rural farmers.
 Limit your response to a single paragraph (max 3 sentences)."""
-    
-    response = model.generate_content(prompt)
-    return _truncate_to_one_paragraph(response.text)
-
-def get_conversation_history(db: Session, conversation_id: int) -> List[dict]:
-    """Get conversation history as a list of message dictionaries"""
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-    if not conversation:
-        return []
-    
-    messages = db.query(Message).filter(Message.conversation_id == conversation_id).order_by(Message.created_at).all()
-    return [{"role": msg.role, "content": msg.content} for msg in messages]
-
-def create_conversation(db: Session, user_id: int, conversation_type: str, crop: Optional[str] = None, disease: Optional[str] = None) -> Conversation:
-    """Create a new conversation"""
-    conversation = Conversation(
-        user_id=user_id,
-        conversation_type=conversation_type,
-        crop=crop,
-        disease=disease
-    )
-    db.add(conversation)
-    db.commit()
-    db.refresh(conversation)
-    return conversation
-
-def add_message_to_conversation(db: Session, conversation_id: int, role: str, content: str) -> Message:
-    """Add a message to a conversation"""
-    message = Message(
-        conversation_id=conversation_id,
-        role=role,
-        content=content
-    )
-    db.add(message)
-    db.commit()
-    db.refresh(message)
-    return message
\ No newline at end of file
+
+async def generate_crop_disease_response(
+    disease,
+    crop,
+    llm: LLMService,
+    conversation_history: Optional[List[dict]] = None,
+    request: Optional[Request] = None,
+    language: str = "en",
+    summary: Optional[str] = None
+):
+    prompt = build_crop_disease_prompt(disease, crop, conversation_history, language, summary)
+    response = await llm.generate(prompt, request=request)
+    return _truncate_to_one_paragraph(response)
+
+async def generate_general_chat_response(
+    message: str,
+    llm: LLMService,
+    conversation_history: Optional[List[dict]] = None,
+    request: Optional[Request] = None,
+    summary: Optional[str] = None
+):
+    prompt = build_general_chat_prompt(message, conversation_history, summary)
+    response = await llm.generate(prompt, request=request)
+    return _truncate_to_one_paragraph(response)
+
+def stream_crop_disease_response(
+    disease,
+    crop,
+    llm: LLMService,
+    conversation_history: Optional[List[dict]] = None,
+    language: str = "en",
+    summary: Optional[str] = None
+) -> AsyncIterator[str]:
+    prompt = build_crop_disease_prompt(disease, crop, conversation_history, language, summary)
+    return stream_one_paragraph(llm.stream(prompt))
+
+def stream_general_chat_response(
+    message: str,
+    llm: LLMService,
+    conversation_history: Optional[List[dict]] = None,
+    summary: Optional[str] = None
+) -> AsyncIterator[str]:
+    prompt = build_general_chat_prompt(message, conversation_history, summary)
+    return stream_one_paragraph(llm.stream(prompt))
+
+def get_conversation_history(
+    db: Session,
+    conversation_id: int,
+    start: int = 0,
+    limit: Optional[int] = None
+) -> List[dict]:
+    """Get conversation history as a list of message dictionaries, optionally skipping
+    the first start messages (e.g. those already covered by the summary)"""
+    # Both messages of a turn share a timestamp, so id breaks the tie
+    messages = db.query(Message.role, Message.content).filter(
+        Message.conversation_id == conversation_id
+    ).order_by(Message.created_at, Message.id).offset(start).limit(limit).all()
+    return [{"role": role, "content": content} for role, content in messages]
+
+def save_chat_turn(
+    db: Session,
+    conversation_id: Optional[int],
+    user_message: str,
+    assistant_message: str,
+    new_conversation: Optional[dict] = None,
+    writer: Optional[MessageWriter] = None
+) -> int:
+    """Save a user message and its reply in one transaction and return the conversation id.
+    Without conversation_id, a conversation is created from new_conversation's fields.
+    With a writer, the messages are queued for it instead; only a new conversation is written now."""
+    messages = [{"role": "user", "content": user_message}, {"role": "assistant", "content": assistant_message}]
+    if writer is not None:
+        if conversation_id is None:
+            # The writer counts the messages when it writes them
+            conversation = Conversation(**new_conversation, message_count=0)
+            try:
+                db.add(conversation)
+                db.flush()
+                conversation_id = conversation.id
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        writer.enqueue(conversation_id, messages)
+        return conversation_id
+
+    try:
+        if conversation_id is None:
+            conversation = Conversation(**new_conversation, message_count=2)
+            db.add(conversation)
+            db.flush()
+            conversation_id = conversation.id
+        else:
+            # Conditional so two concurrent turns cannot both pass the limit
+            result = db.execute(
+                update(Conversation)
+                .where(
+                    Conversation.id == conversation_id,
+                    Conversation.message_count < MAX_MESSAGES_PER_CONVERSATION
+                )
+                .values(message_count=Conversation.message_count + 2, updated_at=func.now())
+            )
+            if result.rowcount == 0:
+                raise ConversationFull()
+        db.execute(insert(Message), [{"conversation_id": conversation_id, **msg} for msg in messages])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return conversation_id
@@ -0,0 +1,286 @@
+"""
+Write-behind persistence of chat messages (CHAT_WRITE_BEHIND_ENABLED).
+
+With write-behind on, a chat turn is answered as soon as its messages are
+queued in memory. A background task writes queued turns every
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS (or as soon as a batch is full) in
+one transaction on a worker thread, so the event loop keeps serving
+requests and streams meanwhile: one multi-row INSERT of the messages and
+one executemany UPDATE of the conversations' message_count and updated_at,
+so counts and rows never disagree. A new conversation's row is still
+inserted when its first turn is saved, because the client needs its id.
+
+The message limit is enforced again when writing: the batch locks its
+conversations' rows (SELECT ... FOR UPDATE) and, like the synchronous
+path, a turn is only written while the conversation holds fewer than the
+maximum number of messages. Turns refused there are dropped and logged.
+
+Turns stay visible through pending_messages() until their batch commits,
+which keeps read-your-writes for the next turn's history and message limit
+in this worker; wait_written() lets that turn wait out a batch of its own
+conversation that is being written, so it is never counted twice.
+
+Database errors are retried with exponential backoff
+(CHAT_WRITE_BEHIND_RETRY_BACKOFF_SECONDS, doubling up to
+CHAT_WRITE_BEHIND_MAX_BACKOFF_SECONDS) for as long as they last, so a
+database restart or failover only delays writes. Turns are dropped only
+when the database refuses them (an integrity or data error): such a batch
+is written one turn at a time and each refused turn is logged with its
+conversation id. While CHAT_WRITE_BEHIND_MAX_QUEUED_TURNS turns are
+waiting, new chat turns are refused with 503 instead of growing the queue
+without bound (turns already answered are still queued). Shutdown flushes
+whatever is queued; turns the database cannot take by then are logged.
+
+Trade-offs: queued turns are lost if the process dies, and another worker
+does not see them until they are flushed.
+"""
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.db.database import SessionLocal
+from app.db.models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+# Errors caused by the rows themselves; anything else (lost connections, failover, timeouts) is retried
+REFUSED_ERRORS = (IntegrityError, DataError)
+
+
+@dataclass
+class PendingTurn:
+    conversation_id: int
+    messages: List[dict]  # {"role": ..., "content": ...} in conversation order
+
+
+class MessageWriter:
+    """In-process queue of chat turns, flushed to the database in batches"""
+
+    def __init__(
+        self,
+        max_messages: int,
+        batch_size: int = 500,
+        flush_interval: float = 0.05,
+        retry_backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        max_queued_turns: int = 10000,
+        on_written: Optional[Callable[[int], None]] = None
+    ):
+        self.max_messages = max_messages
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max(retry_backoff, max_backoff)
+        self.max_queued_turns = max(1, max_queued_turns)
+        self.on_written = on_written  # Called with each conversation id once its turns are written
+        self._queue: Deque[PendingTurn] = deque()
+        self._pending: Dict[int, List[dict]] = {}
+        self._batch_full = asyncio.Event()
+        self._writing: set = set()  # Conversations in the batch being written
+        self._written_event = asyncio.Event()
+        self._task = None
+        self._stopping = asyncio.Event()
+
+        # Statistics
+        self.flushed_messages = 0
+        self.batches = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected_turns = 0
+        self.dropped_messages = 0
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def enqueue(self, conversation_id: int, messages: List[dict]) -> None:
+        self._queue.append(PendingTurn(conversation_id, messages))
+        self._pending.setdefault(conversation_id, []).extend(messages)
+        if len(self._queue) >= self.batch_size:
+            self._batch_full.set()
+
+    @property
+    def backlogged(self) -> bool:
+        """True while the queue is full, e.g. because the database is unreachable"""
+        return len(self._queue) >= self.max_queued_turns
+
+    def pending_messages(self, conversation_id: int) -> List[dict]:
+        """Messages of the conversation that are queued but not written yet"""
+        return list(self._pending.get(conversation_id, ()))
+
+    async def wait_written(self, conversation_id: int) -> None:
+        """Wait while a batch holding this conversation's turns is being written, so that
+        the database and pending_messages() do not both contain them"""
+        while conversation_id in self._writing:
+            await self._written_event.wait()
+
+    async def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_full.clear()
+            await self.flush()
+
+    async def flush(self, final: bool = False) -> None:
+        """Write everything queued so far. Failed writes are retried until they succeed, shutdown
+        begins or, with final, once; only turns refused by the database are dropped."""
+        backoff = self.retry_backoff
+        while self._queue:
+            batch = [self._queue[i] for i in range(min(self.batch_size, len(self._queue)))]
+            try:
+                try:
+                    refused = await self._write_in_thread(batch)
+                except REFUSED_ERRORS:
+                    self.failures += 1
+                    # Keep one bad turn from losing the whole batch
+                    logger.warning("A batch of %d chat turns was refused, writing them one by one", len(batch),
+                                   exc_info=True)
+                    await self._write_one_by_one(batch)
+                else:
+                    self.rejected_turns += len(refused)
+                    self._written(batch, refused)
+                backoff = self.retry_backoff
+            except Exception:
+                self.failures += 1
+                if final:
+                    self._drop_queue()
+                    return
+                if self._stopping.is_set():
+                    # shutdown() makes the final attempt
+                    return
+                self.retries += 1
+                logger.warning("Writing %d queued chat turns failed, retrying in %.1fs", len(self._queue), backoff,
+                               exc_info=True)
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _write_one_by_one(self, batch: List[PendingTurn]) -> None:
+        """Write a refused batch turn by turn, dropping the turns the database refuses. Other
+        errors propagate and leave the remaining turns queued."""
+        for turn in batch:
+            try:
+                refused = await self._write_in_thread([turn])
+            except REFUSED_ERRORS:
+                logger.exception("Dropping %d messages for conversation %s: refused by the database",
+                                 len(turn.messages), turn.conversation_id)
+                refused = [turn]
+            else:
+                self.rejected_turns += len(refused)
+            self._written([turn], refused)
+
+    def _drop_queue(self) -> None:
+        """Give up on every queued turn, logging what is lost"""
+        lost: Dict[int, int] = {}
+        for turn in self._queue:
+            lost[turn.conversation_id] = lost.get(turn.conversation_id, 0) + len(turn.messages)
+            self.dropped_messages += len(turn.messages)
+        logger.error("Database unavailable at shutdown; dropping queued messages (conversation id: count) %s",
+                     lost, exc_info=True)
+        self._queue.clear()
+        self._pending.clear()
+
+    def _written(self, turns: List[PendingTurn], refused: List[PendingTurn]) -> None:
+        """Take written (or refused) turns off the queue. Runs right after the write, before
+        any wait_written() caller resumes, so no turn is both in the database and pending."""
+        refused_ids = {id(turn) for turn in refused}
+        written = set()
+        for turn in turns:
+            self._queue.popleft()
+            self._forget(turn)
+            if id(turn) in refused_ids:
+                self.dropped_messages += len(turn.messages)
+            else:
+                self.flushed_messages += len(turn.messages)
+                written.add(turn.conversation_id)
+        self.batches += 1
+        if self.on_written is not None:
+            for conversation_id in written:
+                self.on_written(conversation_id)
+
+    async def _write_in_thread(self, batch: List[PendingTurn]) -> List[PendingTurn]:
+        self._writing = {turn.conversation_id for turn in batch}
+        self._written_event.clear()
+        try:
+            return await asyncio.to_thread(self._write, batch)
+        finally:
+            self._writing = set()
+            self._written_event.set()
+
+    def _write(self, batch: List[PendingTurn]) -> List[PendingTurn]:
+        """Write the batch in one transaction; returns the turns refused by the message limit"""
+        conversations = Conversation.__table__
+        db = SessionLocal()
+        try:
+            # Lock the rows so concurrent writers (other workers) see each other's counts
+            counts = dict(db.execute(
+                select(conversations.c.id, conversations.c.message_count)
+                .where(conversations.c.id.in_({turn.conversation_id for turn in batch}))
+                .with_for_update()
+            ).all())
+            added: Dict[int, int] = {}
+            rows, rejected = [], []
+            for turn in batch:
+                count = counts.get(turn.conversation_id)
+                # Same rule as save_chat_turn: a turn is accepted while the limit is not reached
+                if count is None or count >= self.max_messages:
+                    rejected.append(turn)
+                    continue
+                counts[turn.conversation_id] = count + len(turn.messages)
+                added[turn.conversation_id] = added.get(turn.conversation_id, 0) + len(turn.messages)
+                rows.extend({"conversation_id": turn.conversation_id, **msg} for msg in turn.messages)
+
+            if rows:
+                db.execute(insert(Message), rows)
+                db.execute(
+                    update(conversations)
+                    .where(conversations.c.id == bindparam("conversation_id"))
+                    .values(message_count=conversations.c.message_count + bindparam("added"), updated_at=func.now()),
+                    [{"conversation_id": cid, "added": n} for cid, n in added.items()]
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        for turn in rejected:
+            logger.warning("Dropping a queued turn for conversation %s: message limit reached or "
+                           "conversation deleted", turn.conversation_id)
+        return rejected
+
+    def _forget(self, turn: PendingTurn) -> None:
+        pending = self._pending[turn.conversation_id]
+        del pending[:len(turn.messages)]
+        if not pending:
+            del self._pending[turn.conversation_id]
+
+    async def shutdown(self) -> None:
+        """Stop the background task and write whatever is still queued"""
+        # Not cancelled: a batch already handed to a thread must be accounted for, not written twice
+        self._stopping.set()
+        self._batch_full.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush(final=True)
+
+    def stats(self) -> dict:
+        return {
+            "queued_turns": len(self._queue),
+            "pending_messages": sum(len(messages) for messages in self._pending.values()),
+            "flushed_messages": self.flushed_messages,
+            "batches": self.batches,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rejected_turns": self.rejected_turns,
+            "dropped_messages": self.dropped_messages,
+        }
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 
 class Settings(BaseSettings):
     DATABASE_URL: str
@@ -20,6 +21,78 @@ class Settings(BaseSettings):
     MAX_REFRESH_TOKENS_PER_USER: int = 5  # Limit active refresh tokens per user
 
     GENAI_API_KEY: str
+
+    # Chatbot LLM settings
+    CHAT_LLM_PROVIDER: str = "gemini"  # "gemini", or "local" for the offline stand-in used in load tests
+    CHAT_LLM_MODEL: str = "gemini-1.5-flash"
+    CHAT_LLM_MAX_CONCURRENCY: int = 256  # In-flight LLM calls per worker; further calls wait for a slot
+    CHAT_LLM_TIMEOUT_SECONDS: float = 30.0  # Deadline per LLM call, including time waiting for a slot
+    CHAT_LLM_COALESCE: bool = True  # Concurrent identical prompts share one LLM call
+    CHAT_LOCAL_LLM_LATENCY_DISTRIBUTION: str = "lognormal"  # "fixed", "uniform", "lognormal" or "exponential"
+    CHAT_LOCAL_LLM_LATENCY_MS: float = 800.0  # Median time to first token
+    CHAT_LOCAL_LLM_LATENCY_SIGMA: float = 0.5  # Lognormal shape; larger = heavier tail
+    CHAT_LOCAL_LLM_TOKENS_PER_SECOND: float = 50.0  # 0 = whole answer at once
+    CHAT_LOCAL_LLM_ERROR_RATE: float = 0.0  # Share of calls that fail
+    CHAT_LOCAL_LLM_STREAM_CHUNK_TOKENS: int = 4
+    CHAT_LOCAL_LLM_SEED: Optional[int] = None  # Fix for repeatable runs
+    CHAT_ADVICE_CATALOG_ENABLED: bool = True  # Answer first prediction turns from the precomputed catalog
+    CHAT_ADVICE_CATALOG_PATH: str = "app/chatbot/data/advice_catalog.json"  # Built by python -m app.chatbot.catalog
+    CHAT_SEMANTIC_CACHE_ENABLED: bool = False  # Reuse answers to similar first-turn general questions, across users
+    CHAT_SEMANTIC_CACHE_EMBEDDER: str = "hashing"  # "hashing" or a sentence-transformers model, e.g. "all-MiniLM-L6-v2"
+    CHAT_SEMANTIC_CACHE_THRESHOLD: float = 0.9  # Min cosine similarity to serve a cached answer
+    CHAT_SEMANTIC_CACHE_MAX_ENTRIES: int = 1024
+    CHAT_SEMANTIC_CACHE_TTL_SECONDS: float = 86400.0
+    CHAT_MAX_MESSAGES_PER_CONVERSATION: int = 5  # Turns are refused once a conversation holds this many messages
+    CHAT_HISTORY_RECENT_MESSAGES: int = 4  # Sent verbatim; older messages are folded into the summary (none at the default limit)
+    CHAT_HISTORY_TOKEN_BUDGET: int = 1000  # Approximate prompt tokens for summary + recent messages
+    CHAT_WRITE_BEHIND_ENABLED: bool = False  # Queue chat messages and write them in background batches
+    CHAT_WRITE_BEHIND_BATCH_SIZE: int = 500  # Turns per batch; a full batch is written right away
+    CHAT_WRITE_BEHIND_FLUSH_INTERVAL_SECONDS: float = 0.05
+    CHAT_WRITE_BEHIND_RETRY_BACKOFF_SECONDS: float = 0.5  # First retry delay after a failed write, doubled per failure
+    CHAT_WRITE_BEHIND_MAX_BACKOFF_SECONDS: float = 30.0
+    CHAT_WRITE_BEHIND_MAX_QUEUED_TURNS: int = 10000  # New turns get 503 while this many are waiting to be written
+
+    # ML inference settings
+    ML_MODEL_PATH: str = "app/ml/models/plant_disease_model.h5"  # Used when ML_MODEL_VERSION is not in the registry
+    ML_MODEL_REGISTRY_DIR: str = "app/ml/models/registry"  # <version>/plant_disease_model.h5 + class_names.json
+    ML_MODEL_VERSION: str = "1"  # Version loaded at startup
+    ML_ADMIN_TOKEN: Optional[str] = None  # X-Admin-Token for /ml/models endpoints (disabled if unset)
+    ML_BACKEND: str = "keras"  # "keras", "tflite_float16" or "tflite_int8" (see app/ml/convert_tflite.py)
+    ML_TFLITE_NUM_THREADS: int = 0  # 0 = TFLite default
+    ML_KERAS_COMPILED: bool = True  # Call Keras through a fixed-signature tf.function instead of eagerly
+    ML_XLA_JIT: bool = False  # XLA-compile the Keras inference function
+    ML_TF_INTRA_OP_THREADS: int = 0  # 0 = TF default
+    ML_TF_INTER_OP_THREADS: int = 0  # 0 = TF default
+    ML_CASCADE_ENABLED: bool = False  # Try a small model first, fall through to the full model on doubt
+    ML_CASCADE_MODEL_PATH: str = "app/ml/models/plant_disease_model_small.h5"  # Small model for ML_MODEL_PATH
+    ML_CASCADE_THRESHOLD: float = 0.9  # Min small-model top-1 confidence to answer without the full model
+    ML_TTA_ENABLED: bool = False  # Re-check low-confidence predictions with test-time augmentation
+    ML_TTA_THRESHOLD: float = 0.6  # Run TTA when the first-pass confidence is below this
+    ML_TTA_CROP_FRACTION: float = 0.875  # Side length of the TTA crops relative to the image
+    ML_EMBEDDINGS_ENABLED: bool = False  # Store prediction embeddings for /ml/similar (keras backend only)
+    ML_EMBEDDING_LAYER: str = ""  # Layer to take embeddings from ("" = the Dense(128) before the output)
+    ML_EMBEDDINGS_DIR: str = "app/ml/data/embeddings"  # Append-only vector store (see app/ml/vectors.py)
+    ML_SIMILAR_MAX_K: int = 50
+    ML_SIMILAR_NPROBE: int = 8  # IVF lists scanned per query when an index has been built
+    ML_WARMUP_ENABLED: bool = True
+    ML_WARMUP_BATCH_SIZES: list = []  # Empty = every batch size from 1 to ML_MAX_BATCH_SIZE
+    ML_RESIZE_FILTER: str = "nearest"  # "nearest" (matches training), "bilinear" or "bicubic"
+    ML_BATCHING_ENABLED: bool = True
+    ML_MAX_BATCH_SIZE: int = 16  # Max images per model call
+    ML_MAX_BATCH_WAIT_MS: float = 10.0  # Max time the first queued image waits for a batch to fill
+    ML_EXECUTOR_MAX_WORKERS: int = 2  # Threads running decoding/inference off the event loop
+    ML_EXECUTOR_PROCESS_WORKERS: int = 0  # Optional process pool for image decoding (0 = use threads)
+    ML_REQUEST_TIMEOUT_SECONDS: float = 30.0  # Per-request deadline for ML work
+    ML_BATCH_MAX_IMAGES: int = 64  # Max images accepted by /ml/predict/batch
+    ML_MAX_UPLOAD_BYTES: int = 10 * 1024 * 1024  # Max body for /ml/predict and per image in a batch (413 beyond)
+    ML_MAX_BATCH_UPLOAD_BYTES: int = 100 * 1024 * 1024  # Max body for /ml/predict/batch
+    ML_MAX_IMAGE_PIXELS: int = 50_000_000  # Max width * height, checked from the header before decoding
+    ML_ALLOWED_IMAGE_FORMATS: list = ["JPEG", "PNG", "WEBP", "BMP", "RAW"]  # RAW = 224x224x3 uint8 tensor
+    ML_CACHE_ENABLED: bool = True
+    ML_CACHE_MAX_ENTRIES: int = 4096
+    ML_CACHE_TTL_SECONDS: float = 3600.0
+    ML_CACHE_PERCEPTUAL: bool = False  # Also serve near-duplicate photos by perceptual hash
+    ML_CACHE_PHASH_MAX_DISTANCE: int = 4  # Max Hamming distance (of 64 bits) for a near-duplicate match
     
     class Config:
         env_file = ".env"
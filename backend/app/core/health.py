@@ -3,6 +3,8 @@ Health check endpoint for the API.
 Add this to your main.py file to enable health checks.
 """
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.ml.lifecycle import model_lifecycle
 
 health_router = APIRouter(tags=["Health"])
 
@@ -11,5 +13,15 @@ def health_check():
     """Simple health check endpoint to verify API connectivity"""
     return {"status": "ok", "message": "API server is running"}
 
+@health_router.get("/ready")
+def readiness_check():
+    """Readiness probe: 503 until the ML model is loaded and warmed up"""
+    if not model_lifecycle.ready:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "not ready", "model": model_lifecycle.status()}
+        )
+    return {"status": "ready", "model": model_lifecycle.status()}
+
 # Add this to your main FastAPI app
 # app.include_router(health_router)
@@ -1,66 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.sql import func
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-engine = create_engine(os.getenv("DATABASE_URL"))
-Base = declarative_base()
-
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True, nullable=False)
-    hashed_password = Column(String, nullable=False)
-    is_active = Column(Boolean, default=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    
-    # Relationship to refresh tokens
-    refresh_tokens = relationship("RefreshToken", back_populates="user", cascade="all, delete-orphan")
-    # Relationship to conversations
-    conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan")
-
-class RefreshToken(Base):
-    __tablename__ = "refresh_tokens"
-    id = Column(Integer, primary_key=True, index=True)
-    token = Column(String, unique=True, index=True, nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    expires_at = Column(DateTime(timezone=True), nullable=False)
-    is_revoked = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    
-    # Relationship to user
-    user = relationship("User", back_populates="refresh_tokens")
-
-class Conversation(Base):
-    __tablename__ = "conversations"
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    conversation_type = Column(String, nullable=False)  # "general" or "prediction"
-    crop = Column(String, nullable=True)  # For prediction conversations
-    disease = Column(String, nullable=True)  # For prediction conversations
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    
-    # Relationship to user
-    user = relationship("User", back_populates="conversations")
-    # Relationship to messages
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
-
-class Message(Base):
-    __tablename__ = "messages"
-    id = Column(Integer, primary_key=True, index=True)
-    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
-    role = Column(String, nullable=False)  # "user" or "assistant"
-    content = Column(String, nullable=False)  # Assuming Text was meant to be String
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    
-    # Relationship to conversation
-    conversation = relationship("Conversation", back_populates="messages")
+from app.db.database import Base, engine
+# Registers the application's models on Base, so the tables match what the app expects
+from app.db import models  # noqa: F401
 
 Base.metadata.create_all(bind=engine)
-print("✅ Tables created.")
\ No newline at end of file
+print("✅ Tables created.")
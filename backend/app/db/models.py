@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -36,13 +36,24 @@ class Conversation(Base):
     conversation_type = Column(String, nullable=False)  # "general" or "prediction"
     crop = Column(String, nullable=True)  # For prediction conversations
     disease = Column(String, nullable=True)  # For prediction conversations
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")  # Maintained on every turn
+    summary = Column(Text, nullable=True)  # Rolling summary of earlier messages, see app/chatbot/summaries.py
+    summary_message_count = Column(Integer, nullable=False, default=0, server_default="0")  # Messages it covers
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # Relationship to user
     user = relationship("User", back_populates="conversations")
-    # Relationship to messages
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    # Relationship to messages, in conversation order
+    messages = relationship(
+        "Message",
+        back_populates="conversation",
+        cascade="all, delete-orphan",
+        order_by="[Message.created_at, Message.id]"
+    )
+
+    # Keyset pagination of a user's conversations, most recently updated first
+    __table_args__ = (Index("ix_conversations_user_updated", "user_id", "updated_at", "id"),)
 
 class Message(Base):
     __tablename__ = "messages"
@@ -54,3 +65,6 @@ class Message(Base):
     
     # Relationship to conversation
     conversation = relationship("Conversation", back_populates="messages")
+
+    # History lookups and message pagination within a conversation
+    __table_args__ = (Index("ix_messages_conversation_created", "conversation_id", "created_at", "id"),)
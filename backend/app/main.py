@@ -1,17 +1,39 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 from app.auth import router as auth_router
 from app.core.config import get_settings
 from app.ml import router as ml_router
+from app.ml.uploads import UploadLimitMiddleware
 from app.chatbot import router as chatbot_router
 from app.core.health import health_router
 
 settings = get_settings()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Model loading and warmup run in the background so liveness checks answer immediately
+    await ml_router.startup()
+    await chatbot_router.startup()
+    yield
+    # Release ML worker threads/processes on shutdown
+    await ml_router.shutdown()
+    await chatbot_router.shutdown()
+
 app = FastAPI(
     title="AgriCare AI API",
     description="Backend API for AgriCare AI mobile application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+# Reject oversized image uploads while the body is still streaming
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/ml/predict": settings.ML_MAX_UPLOAD_BYTES,
+        "/ml/predict/batch": settings.ML_MAX_BATCH_UPLOAD_BYTES,
+    }
 )
 
 # Global exception handler
@@ -0,0 +1,197 @@
+"""
+Inference backends for the plant disease model.
+All backends take a float32 batch of shape (N, 224, 224, 3) normalized to
+[0, 1] and return an (N, num_classes) array of softmax probabilities, so the
+rest of the ML module does not care whether Keras or TFLite is running.
+The Keras backend can also return penultimate-layer embeddings alongside the
+probabilities for similar-case search.
+TensorFlow is imported lazily so that importing the ML router stays cheap.
+"""
+import logging
+import os
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKEND_KERAS = "keras"
+BACKEND_TFLITE_FLOAT16 = "tflite_float16"
+BACKEND_TFLITE_INT8 = "tflite_int8"
+BACKENDS = (BACKEND_KERAS, BACKEND_TFLITE_FLOAT16, BACKEND_TFLITE_INT8)
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+def tflite_path_for(model_path: str, variant: str) -> str:
+    """Default location of a converted model, e.g. plant_disease_model_int8.tflite next to the .h5"""
+    root, _ = os.path.splitext(model_path)
+    return f"{root}_{variant}.tflite"
+
+
+class InferenceBackend:
+    name = "base"
+    embedding_dim: Optional[int] = None  # Set when predict_with_embeddings is available
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def predict_with_embeddings(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError(f"The {self.name} backend does not expose embeddings")
+
+
+# Set once the thread pools have been configured; the TF runtime cannot change them afterwards
+_tf_threads_configured = False
+
+
+def configure_tf_threads(intra_op_threads: int = 0, inter_op_threads: int = 0) -> None:
+    """Set per-worker TF thread pools (0 = TF default); only effective before the TF runtime starts,
+    so calls after the first (e.g. on later model deploys) do nothing"""
+    global _tf_threads_configured
+    if _tf_threads_configured:
+        return
+    _tf_threads_configured = True
+    import tensorflow as tf
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        logger.warning("TF thread settings ignored, runtime already initialized: %s", e)
+
+
+def _embedding_layer(model, name: str = ""):
+    """The named layer, or by default the last Dense layer before the output (the Dense(128) head)"""
+    import tensorflow as tf
+    if name:
+        return model.get_layer(name)
+    dense_layers = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Dense)]
+    if len(dense_layers) < 2:
+        raise ValueError("Model has no penultimate Dense layer to take embeddings from")
+    return dense_layers[-2]
+
+
+class KerasBackend(InferenceBackend):
+    """Keras model called through a tf.function with a fixed (None, 224, 224, 3) float32 signature.
+    This skips model.predict's per-call data adapter/callback setup and traces exactly once."""
+
+    name = BACKEND_KERAS
+
+    def __init__(
+        self,
+        model,
+        compiled: bool = True,
+        jit_compile: bool = False,
+        embedding_layer: Optional[str] = None
+    ):
+        import tensorflow as tf
+        self.model = model
+        self.compiled = compiled
+        self.jit_compile = jit_compile
+        self._infer = self._wrap(lambda x: model(x, training=False))
+
+        if embedding_layer is not None:
+            # Same weights, second output: probabilities plus the penultimate activations
+            layer = _embedding_layer(model, embedding_layer)
+            embedding_model = tf.keras.Model(model.inputs, [model.outputs[0], layer.output])
+            self.embedding_dim = int(layer.output.shape[-1])
+            self._infer_embeddings = self._wrap(lambda x: embedding_model(x, training=False))
+
+    def _wrap(self, fn):
+        if not self.compiled:
+            return fn
+        import tensorflow as tf
+        return tf.function(
+            fn,
+            input_signature=[tf.TensorSpec(shape=(None,) + INPUT_SHAPE, dtype=tf.float32)],
+            jit_compile=self.jit_compile,
+            reduce_retracing=True
+        )
+
+    @classmethod
+    def from_path(
+        cls,
+        model_path: str,
+        compiled: bool = True,
+        jit_compile: bool = False,
+        embedding_layer: Optional[str] = None
+    ) -> "KerasBackend":
+        import tensorflow as tf
+        return cls(tf.keras.models.load_model(model_path, compile=False), compiled, jit_compile, embedding_layer)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self._infer(batch).numpy()
+
+    def predict_with_embeddings(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.embedding_dim is None:
+            return super().predict_with_embeddings(batch)
+        probabilities, embeddings = self._infer_embeddings(batch)
+        return probabilities.numpy(), embeddings.numpy()
+
+
+class TFLiteBackend(InferenceBackend):
+    """TFLite interpreter backend; one interpreter per thread since interpreters are not thread-safe"""
+
+    def __init__(self, model_path: str, name: str = BACKEND_TFLITE_FLOAT16, num_threads: int = 0):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"TFLite model not found: {model_path} (run python -m app.ml.convert_tflite)")
+        self.model_path = model_path
+        self.name = name
+        self.num_threads = num_threads or None
+        self._local = threading.local()
+
+    def _interpreter(self):
+        interpreter = getattr(self._local, "interpreter", None)
+        if interpreter is None:
+            import tensorflow as tf
+            interpreter = tf.lite.Interpreter(model_path=self.model_path, num_threads=self.num_threads)
+            interpreter.allocate_tensors()
+            self._local.interpreter = interpreter
+            self._local.batch_size = int(interpreter.get_input_details()[0]["shape"][0])
+        return interpreter
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        interpreter = self._interpreter()
+        input_details = interpreter.get_input_details()[0]
+        if batch.shape[0] != self._local.batch_size:
+            interpreter.resize_tensor_input(input_details["index"], list(batch.shape))
+            interpreter.allocate_tensors()
+            self._local.batch_size = batch.shape[0]
+            input_details = interpreter.get_input_details()[0]
+
+        scale, zero_point = input_details["quantization"]
+        if input_details["dtype"] != np.float32 and scale:
+            # Full-integer model: quantize the normalized input
+            batch = np.round(batch / scale + zero_point)
+        interpreter.set_tensor(input_details["index"], batch.astype(input_details["dtype"], copy=False))
+        interpreter.invoke()
+
+        output_details = interpreter.get_output_details()[0]
+        output = interpreter.get_tensor(output_details["index"])
+        scale, zero_point = output_details["quantization"]
+        if output_details["dtype"] != np.float32 and scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def load_backend(
+    kind: str,
+    model_path: str,
+    num_threads: int = 0,
+    compiled: bool = True,
+    jit_compile: bool = False,
+    embedding_layer: Optional[str] = None
+) -> InferenceBackend:
+    """Build the backend selected by ML_BACKEND; TFLite variants are looked up next to model_path.
+    embedding_layer ("" = penultimate Dense) enables predict_with_embeddings on the Keras backend."""
+    if kind == BACKEND_KERAS:
+        return KerasBackend.from_path(model_path, compiled, jit_compile, embedding_layer)
+    if embedding_layer is not None:
+        logger.warning("Embeddings are only available with the keras backend; similar-case capture is off")
+    if kind == BACKEND_TFLITE_FLOAT16:
+        return TFLiteBackend(tflite_path_for(model_path, "float16"), kind, num_threads)
+    if kind == BACKEND_TFLITE_INT8:
+        return TFLiteBackend(tflite_path_for(model_path, "int8"), kind, num_threads)
+    raise ValueError(f"Unknown ML backend '{kind}', expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,199 @@
+"""
+Dynamic micro-batching for model inference.
+Concurrent /ml/predict requests are queued and flushed to the model as a
+single batch once either max_batch_size images are waiting or the oldest
+request has waited max_wait_ms. Each request names the backend it should run
+on; a flushed batch is split into one model call per backend. Requests that
+ask for embeddings get them from the same forward pass.
+"""
+import asyncio
+import time
+from collections import Counter
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from .backends import InferenceBackend
+from .executor import InferenceExecutor
+from .preprocessing import IMG_SIZE, StageTimings
+from .utils import decode_prediction
+
+
+class _PendingPrediction:
+    __slots__ = ("img_array", "backend", "class_names", "future", "with_embedding", "enqueued_at")
+
+    def __init__(
+        self,
+        img_array: np.ndarray,
+        backend: InferenceBackend,
+        class_names: List[str],
+        future: asyncio.Future,
+        with_embedding: bool = False
+    ):
+        self.img_array = img_array
+        self.backend = backend
+        self.class_names = class_names
+        self.future = future
+        self.with_embedding = with_embedding
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Groups concurrent single-image predictions into one model call per batch"""
+
+    def __init__(
+        self,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+        executor: Optional[InferenceExecutor] = None,
+        timings: Optional[StageTimings] = None
+    ):
+        self.executor = executor
+        self.timings = timings
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Preallocated model input, reused for every batch; replaced when a model call is abandoned
+        self._batch_buffer = self._new_batch_buffer()
+
+        # Statistics
+        self._batch_sizes = Counter()
+        self._total_requests = 0
+        self._total_batches = 0
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+        self._total_model_time = 0.0
+
+    def _new_batch_buffer(self) -> np.ndarray:
+        return np.empty((self.max_batch_size,) + IMG_SIZE + (3,), dtype=np.float32)
+
+    def _ensure_started(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(
+        self,
+        img_array: np.ndarray,
+        backend: InferenceBackend,
+        class_names: List[str],
+        with_embedding: bool = False
+    ) -> Union[Tuple[str, float], Tuple[str, float, np.ndarray]]:
+        """Queue one preprocessed (224, 224, 3) image and wait for its prediction on the given backend.
+        With with_embedding, the result also carries the image's embedding vector."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingPrediction(img_array, backend, class_names, future, with_embedding))
+        self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def stop(self) -> None:
+        """Cancel the worker; pending callers receive a CancelledError"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while self._queue is not None and not self._queue.empty():
+            pending = self._queue.get_nowait()
+            if not pending.future.done():
+                pending.future.cancel()
+
+    async def _collect_batch(self) -> List[_PendingPrediction]:
+        batch = [await self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Drain whatever is already queued without yielding
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _predict_batch(self, predict, batch_array: np.ndarray):
+        if self.executor is not None:
+            return await self.executor.run(predict, batch_array)
+        return await asyncio.get_running_loop().run_in_executor(None, predict, batch_array)
+
+    async def _run(self) -> None:
+        while True:
+            collected = await self._collect_batch()
+            # Callers that gave up (e.g. client disconnected) are dropped from the batch
+            groups = {}
+            for pending in collected:
+                if not pending.future.done():
+                    groups.setdefault(id(pending.backend), []).append(pending)
+            for batch in groups.values():
+                await self._run_batch(batch)
+
+    async def _run_batch(self, batch: List[_PendingPrediction]) -> None:
+        started = time.perf_counter()
+        self._total_wait += sum(started - pending.enqueued_at for pending in batch)
+        model_returned = False
+        try:
+            batch_array = self._batch_buffer[:len(batch)]
+            np.stack([pending.img_array for pending in batch], out=batch_array)
+            backend = batch[0].backend
+            embeddings = None
+            if any(pending.with_embedding for pending in batch):
+                predictions, embeddings = await self._predict_batch(backend.predict_with_embeddings, batch_array)
+            else:
+                predictions = await self._predict_batch(backend.predict, batch_array)
+            model_returned = True
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        finally:
+            if not model_returned:
+                # After a timeout or cancellation the worker thread may still be reading the buffer,
+                # so the next batch must not overwrite it
+                self._batch_buffer = self._new_batch_buffer()
+            elapsed = time.perf_counter() - started
+            self._total_model_time += elapsed
+            self._record_batch(len(batch))
+            if self.timings is not None:
+                self.timings.record({"model": elapsed * 1000.0})
+
+        for i, (pending, prediction) in enumerate(zip(batch, predictions)):
+            if pending.future.done():
+                continue
+            try:
+                result = decode_prediction(prediction, pending.class_names)
+                if pending.with_embedding:
+                    result += (embeddings[i],)
+                pending.future.set_result(result)
+            except Exception as e:
+                pending.future.set_exception(e)
+
+    def _record_batch(self, size: int) -> None:
+        self._batch_sizes[size] += 1
+        self._total_batches += 1
+        self._total_requests += size
+
+    def stats(self) -> dict:
+        """Queue depth and batch size statistics for tuning max_batch_size / max_wait_ms"""
+        batches = self._total_batches
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self._max_queue_depth,
+            "total_requests": self._total_requests,
+            "total_batches": batches,
+            "avg_batch_size": self._total_requests / batches if batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+            "avg_queue_wait_ms": self._total_wait / self._total_requests * 1000.0 if self._total_requests else 0.0,
+            "avg_model_time_ms": self._total_model_time / batches * 1000.0 if batches else 0.0,
+        }
@@ -0,0 +1,147 @@
+"""
+Content-addressed cache of prediction results.
+Entries are keyed on a SHA-256 digest of the uploaded bytes plus the backend
+and model version, so a retried upload of the same photo is answered without
+running the network. With perceptual mode enabled, near-duplicates (re-compressed or
+slightly resized copies) are matched by the Hamming distance of a 64-bit
+DCT perceptual hash.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .preprocessing import ImageSource, open_source, raw_tensor_content, raw_tensor_pixels
+
+_PHASH_SIZE = 32
+_PHASH_BITS = 8
+_DIGEST_CHUNK_SIZE = 256 * 1024
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * i + 1) * k / (2 * n)).astype(np.float32)
+
+
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+
+def content_digest(source: ImageSource) -> str:
+    """SHA-256 of the image bytes; file sources are hashed in chunks rather than read whole"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    stream = open_source(source)
+    for chunk in iter(lambda: stream.read(_DIGEST_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def perceptual_hash(source: ImageSource) -> int:
+    """64-bit pHash: sign of the low-frequency DCT coefficients of a 32x32 grayscale thumbnail"""
+    raw = raw_tensor_content(source)
+    img = Image.fromarray(raw_tensor_pixels(raw)) if raw is not None else Image.open(open_source(source))
+    with img:
+        img.draft("L", (_PHASH_SIZE * 2, _PHASH_SIZE * 2))  # Cheap reduced-size JPEG decode
+        thumb = img.convert("L").resize((_PHASH_SIZE, _PHASH_SIZE), Image.BILINEAR)
+    pixels = np.asarray(thumb, dtype=np.float32)
+    low = (_DCT @ pixels @ _DCT.T)[:_PHASH_BITS, :_PHASH_BITS].flatten()
+    bits = low > np.median(low[1:])  # Exclude the DC term from the threshold
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class PredictionCache:
+    """Bounded LRU cache of (predicted_class, confidence) with TTL and hit/miss counters"""
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 4096,
+        ttl_seconds: float = 3600.0,
+        perceptual: bool = False,
+        max_hash_distance: int = 4
+    ):
+        self.namespace = namespace
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl_seconds
+        self.perceptual = perceptual
+        self.max_hash_distance = max_hash_distance
+
+        # key -> (expires_at, model_version, phash, result)
+        self._entries: "OrderedDict[str, Tuple[float, str, Optional[int], tuple]]" = OrderedDict()
+
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def make_key(self, digest: str, model_version: str) -> str:
+        return f"{self.namespace}:{model_version}:{digest}"
+
+    def _expire(self, key: str) -> None:
+        del self._entries[key]
+        self.expirations += 1
+
+    def get(self, key: str) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] < time.monotonic():
+                self._expire(key)
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+        if not self.perceptual:
+            self.misses += 1
+        return None
+
+    def get_similar(self, phash: int, model_version: str) -> Optional[tuple]:
+        """Look up a near-duplicate by perceptual hash (call after an exact-key miss)"""
+        now = time.monotonic()
+        keys, hashes = [], []
+        for key, (expires_at, entry_version, entry_hash, _) in self._entries.items():
+            if entry_hash is not None and entry_version == model_version and expires_at >= now:
+                keys.append(key)
+                hashes.append(entry_hash)
+        if hashes:
+            xor = np.array(hashes, dtype=np.uint64) ^ np.uint64(phash)
+            distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+            best = int(np.argmin(distances))
+            if distances[best] <= self.max_hash_distance:
+                self._entries.move_to_end(keys[best])
+                self.perceptual_hits += 1
+                return self._entries[keys[best]][3]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, model_version: str, result: tuple, phash: Optional[int] = None) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, model_version, phash, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.perceptual_hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "perceptual": self.perceptual,
+            "hits": self.hits,
+            "perceptual_hits": self.perceptual_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.perceptual_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,130 @@
+"""
+Export the Keras plant disease model to TFLite and check parity.
+
+Usage (from the backend directory):
+    python -m app.ml.convert_tflite --calibration-dir samples/ --parity-dir samples/
+
+Writes plant_disease_model_float16.tflite and plant_disease_model_int8.tflite
+next to the .h5 file. The int8 model uses post-training quantization
+calibrated on images from --calibration-dir. With --parity-dir, every
+converted model is compared against the Keras model for top-1 agreement,
+max probability drift and single-image latency.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from typing import List
+
+import numpy as np
+import tensorflow as tf
+
+from .backends import KerasBackend, TFLiteBackend, tflite_path_for
+from .utils import IMAGE_EXTENSIONS, load_image_array
+
+DEFAULT_MODEL_PATH = "app/ml/models/plant_disease_model.h5"
+
+
+def find_images(directory: str, limit: int) -> List[str]:
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    paths.sort()
+    random.Random(0).shuffle(paths)
+    return paths[:limit]
+
+
+def load_images(paths: List[str]) -> np.ndarray:
+    arrays = []
+    for path in paths:
+        with open(path, "rb") as f:
+            arrays.append(load_image_array(f.read()))
+    return np.stack(arrays).astype(np.float32)
+
+
+def convert(model, variant: str, calibration: np.ndarray = None) -> bytes:
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        if calibration is None or not len(calibration):
+            raise ValueError("int8 conversion needs calibration images (--calibration-dir)")
+
+        def representative_dataset():
+            for img_array in calibration:
+                yield [img_array[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Input/output stay float32 so the backend interface is unchanged
+    else:
+        raise ValueError(f"Unknown variant '{variant}'")
+    return converter.convert()
+
+
+def _latency_ms(backend, images: np.ndarray, repeats: int) -> dict:
+    backend.predict(images[:1])  # Warm up
+    timings = []
+    for _ in range(repeats):
+        for img_array in images:
+            started = time.perf_counter()
+            backend.predict(img_array[np.newaxis])
+            timings.append((time.perf_counter() - started) * 1000.0)
+    return {"p50": float(np.percentile(timings, 50)), "p95": float(np.percentile(timings, 95))}
+
+
+def parity_check(reference, candidates: dict, images: np.ndarray, repeats: int = 1) -> dict:
+    """Compare each candidate backend against the reference on the same images"""
+    reference_probs = np.concatenate([reference.predict(img_array[np.newaxis]) for img_array in images])
+    reference_top1 = reference_probs.argmax(axis=1)
+    report = {
+        "images": int(len(images)),
+        reference.name: {"latency_ms": _latency_ms(reference, images, repeats)},
+    }
+    for name, backend in candidates.items():
+        probs = np.concatenate([backend.predict(img_array[np.newaxis]) for img_array in images])
+        report[name] = {
+            "top1_agreement": float(np.mean(probs.argmax(axis=1) == reference_top1)),
+            "max_abs_prob_diff": float(np.max(np.abs(probs - reference_probs))),
+            "latency_ms": _latency_ms(backend, images, repeats),
+            "size_bytes": os.path.getsize(backend.model_path),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH, help="Keras .h5 model to convert")
+    parser.add_argument("--variants", nargs="+", default=["float16", "int8"], choices=["float16", "int8"])
+    parser.add_argument("--calibration-dir", help="Directory of sample leaf images for int8 calibration")
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    parser.add_argument("--parity-dir", help="Directory of images for the parity check (skipped if omitted)")
+    parser.add_argument("--parity-samples", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3, help="Latency measurement passes over the parity images")
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model, compile=False)
+
+    calibration = None
+    if args.calibration_dir:
+        calibration = load_images(find_images(args.calibration_dir, args.calibration_samples))
+        print(f"Loaded {len(calibration)} calibration images")
+
+    candidates = {}
+    for variant in args.variants:
+        output_path = tflite_path_for(args.model, variant)
+        with open(output_path, "wb") as f:
+            f.write(convert(model, variant, calibration))
+        print(f"Wrote {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB)")
+        candidates[f"tflite_{variant}"] = TFLiteBackend(output_path, f"tflite_{variant}")
+
+    if args.parity_dir:
+        images = load_images(find_images(args.parity_dir, args.parity_samples))
+        report = parity_check(KerasBackend(model), candidates, images, args.repeats)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
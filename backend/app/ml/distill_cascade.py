@@ -0,0 +1,141 @@
+"""
+Train the small first-stage model for the confidence cascade by distilling
+the full plant disease model.
+
+Usage (from the backend directory):
+    python -m app.ml.distill_cascade --data-dir leaves/ --alpha 0.35 --image-size 128
+
+The student is a MobileNetV2 (width multiplier --alpha, --image-size input)
+with the same 15-class softmax head. It takes the same (N, 224, 224, 3)
+input in [0, 1] as the full model and resizes internally, so every backend,
+the batcher and convert_tflite work with it unchanged. Training needs no
+labels: the student learns the full model's temperature-softened outputs on
+the images in --data-dir. A held-out slice reports top-1 agreement with the
+full model and how many images clear each cascade threshold.
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .backends import KerasBackend
+from .constants import class_names
+from .convert_tflite import find_images, load_images
+
+DEFAULT_TEACHER_PATH = "app/ml/models/plant_disease_model.h5"
+DEFAULT_OUTPUT_PATH = "app/ml/models/plant_disease_model_small.h5"
+
+
+def build_student(num_classes: int, alpha: float, image_size: int, pretrained: bool = True):
+    """Return (student, logits_model); both share weights, student ends in softmax"""
+    inputs = tf.keras.Input(shape=(224, 224, 3))
+    x = inputs
+    if image_size != 224:
+        x = tf.keras.layers.Resizing(image_size, image_size, interpolation="bilinear")(x)
+    # The serving input is [0, 1]; MobileNetV2's ImageNet weights expect [-1, 1]
+    x = tf.keras.layers.Rescaling(2.0, offset=-1.0)(x)
+    base = tf.keras.applications.MobileNetV2(
+        input_shape=(image_size, image_size, 3),
+        alpha=alpha,
+        include_top=False,
+        weights="imagenet" if pretrained else None,
+        pooling="avg"
+    )
+    x = base(x)
+    x = tf.keras.layers.Dropout(0.2)(x)
+    logits = tf.keras.layers.Dense(num_classes)(x)
+    outputs = tf.keras.layers.Softmax()(logits)
+    return tf.keras.Model(inputs, outputs), tf.keras.Model(inputs, logits)
+
+
+def _batches(paths, batch_size: int):
+    for start in range(0, len(paths), batch_size):
+        yield load_images(paths[start:start + batch_size])
+
+
+def distill(teacher, logits_model, paths, epochs: int, batch_size: int, temperature: float, learning_rate: float):
+    optimizer = tf.keras.optimizers.Adam(learning_rate)
+
+    @tf.function(reduce_retracing=True)
+    def train_step(x, teacher_probs):
+        soft_targets = tf.nn.softmax(tf.math.log(teacher_probs + 1e-7) / temperature)
+        with tf.GradientTape() as tape:
+            logits = logits_model(x, training=True)
+            loss = tf.reduce_mean(
+                tf.keras.losses.categorical_crossentropy(soft_targets, logits / temperature, from_logits=True)
+            ) * temperature ** 2
+        gradients = tape.gradient(loss, logits_model.trainable_variables)
+        optimizer.apply_gradients(zip(gradients, logits_model.trainable_variables))
+        return loss
+
+    paths = list(paths)
+    for epoch in range(epochs):
+        random.Random(epoch).shuffle(paths)
+        started, losses = time.perf_counter(), []
+        for batch in _batches(paths, batch_size):
+            losses.append(float(train_step(batch, teacher.predict(batch))))
+        print(f"epoch {epoch + 1}/{epochs}: loss {np.mean(losses):.4f} ({time.perf_counter() - started:.0f}s)")
+
+
+def evaluate(teacher, student, paths, batch_size: int, thresholds) -> dict:
+    """Top-1 agreement with the teacher overall and above each confidence threshold"""
+    teacher_top, student_top, student_conf = [], [], []
+    for batch in _batches(paths, batch_size):
+        teacher_top.append(np.argmax(teacher.predict(batch), axis=1))
+        probs = student.predict(batch)
+        student_top.append(np.argmax(probs, axis=1))
+        student_conf.append(np.max(probs, axis=1))
+    teacher_top, student_top, student_conf = map(np.concatenate, (teacher_top, student_top, student_conf))
+    agree = teacher_top == student_top
+
+    report = {"images": int(agree.size), "top1_agreement": float(agree.mean()), "thresholds": {}}
+    for threshold in thresholds:
+        confident = student_conf >= threshold
+        report["thresholds"][str(threshold)] = {
+            "answered_by_small": float(confident.mean()),
+            "agreement_when_answered": float(agree[confident].mean()) if confident.any() else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", required=True, help="Directory of leaf images (labels not needed)")
+    parser.add_argument("--teacher", default=DEFAULT_TEACHER_PATH, help="Full Keras model to distill")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH)
+    parser.add_argument("--alpha", type=float, default=0.35, help="MobileNetV2 width multiplier")
+    parser.add_argument("--image-size", type=int, default=128, choices=[96, 128, 160, 192, 224])
+    parser.add_argument("--no-pretrained", action="store_true", help="Do not start from ImageNet weights")
+    parser.add_argument("--samples", type=int, default=20000, help="Max images used from --data-dir")
+    parser.add_argument("--holdout", type=float, default=0.1, help="Fraction of images kept for evaluation")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.8, 0.9, 0.95])
+    args = parser.parse_args()
+
+    paths = find_images(args.data_dir, args.samples)
+    holdout = max(1, int(len(paths) * args.holdout))
+    train_paths, eval_paths = paths[holdout:], paths[:holdout]
+    if not train_paths:
+        raise SystemExit(f"Not enough images in {args.data_dir}")
+    print(f"{len(train_paths)} training images, {len(eval_paths)} held out")
+
+    teacher = KerasBackend.from_path(args.teacher)
+    student, logits_model = build_student(len(class_names), args.alpha, args.image_size, not args.no_pretrained)
+    print(f"Student parameters: {student.count_params():,} (teacher {teacher.model.count_params():,})")
+
+    distill(teacher, logits_model, train_paths, args.epochs, args.batch_size, args.temperature, args.learning_rate)
+    student.save(args.output)
+    print(f"Wrote {args.output}")
+
+    report = evaluate(teacher, KerasBackend(student), eval_paths, args.batch_size, args.thresholds)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Bounded executor for blocking ML work (image decoding and model inference).
+Keeps TensorFlow and PIL calls off the asyncio event loop so that auth and
+health endpoints stay responsive while predictions are running.
+"""
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class InferenceExecutor:
+    """Thread pool (plus optional process pool for CPU-bound decoding) with bounded concurrency and timeouts"""
+
+    def __init__(self, max_workers: int = 2, timeout: float = 30.0, process_workers: int = 0):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.process_workers = max(0, process_workers)
+
+        self._threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ml-inference")
+        self._processes: Optional[ProcessPoolExecutor] = (
+            ProcessPoolExecutor(max_workers=self.process_workers) if self.process_workers else None
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        # Statistics
+        self._in_flight = 0
+        self._waiting = 0
+        self._completed = 0
+        self._timeouts = 0
+        self._failures = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers + self.process_workers)
+        return self._semaphore
+
+    async def _submit(
+        self,
+        pool: Executor,
+        fn: Callable[..., T],
+        *args,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None
+    ) -> T:
+        if deadline is None:
+            timeout = self.timeout if timeout is None else timeout
+            deadline = time.monotonic() + timeout if timeout else None
+        semaphore = self._get_semaphore()
+
+        self._waiting += 1
+        try:
+            if deadline is None:
+                await semaphore.acquire()
+            else:
+                await asyncio.wait_for(semaphore.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+            if deadline is None:
+                result = await future
+            else:
+                # The worker keeps running to completion; only the caller stops waiting
+                result = await asyncio.wait_for(future, max(0.0, deadline - time.monotonic()))
+            self._completed += 1
+            return result
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise
+        except Exception:
+            self._failures += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            semaphore.release()
+
+    async def run(
+        self, fn: Callable[..., T], *args, timeout: Optional[float] = None, deadline: Optional[float] = None
+    ) -> T:
+        """Run fn(*args) on the inference thread pool. deadline (time.monotonic()) bounds a whole
+        request made of several calls; otherwise each call gets timeout, or the default timeout."""
+        return await self._submit(self._threads, fn, *args, timeout=timeout, deadline=deadline)
+
+    async def run_cpu(
+        self, fn: Callable[..., T], *args, timeout: Optional[float] = None, deadline: Optional[float] = None
+    ) -> T:
+        """Run a picklable, CPU-bound fn(*args) on the process pool, falling back to threads"""
+        pool = self._processes if self._processes is not None else self._threads
+        return await self._submit(pool, fn, *args, timeout=timeout, deadline=deadline)
+
+    def shutdown(self) -> None:
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "process_workers": self.process_workers,
+            "timeout_seconds": self.timeout,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "completed": self._completed,
+            "timeouts": self._timeouts,
+            "failures": self._failures,
+        }
@@ -0,0 +1,145 @@
+"""
+Managed model lifecycle: deferred loading, warmup, readiness and deploys.
+The model is loaded from the app lifespan hook in a background thread so the
+worker starts serving liveness checks immediately; /ready reports "ready"
+only after warmup batches have run at every supported batch size. New
+registry versions go through the same load and warmup before they receive
+traffic.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import get_settings
+from .backends import InferenceBackend
+from .preprocessing import IMG_SIZE, TTA_VIEWS
+from .registry import ModelRegistry, ModelVersion, load_model_version
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+STATE_NOT_LOADED = "not_loaded"
+STATE_LOADING = "loading"
+STATE_WARMING_UP = "warming_up"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+class ModelNotReadyError(RuntimeError):
+    pass
+
+
+def warmup_batch_sizes() -> List[int]:
+    """Configured warmup sizes, defaulting to every batch size the batcher can produce"""
+    sizes = settings.ML_WARMUP_BATCH_SIZES or list(range(1, settings.ML_MAX_BATCH_SIZE + 1))
+    if settings.ML_TTA_ENABLED and TTA_VIEWS not in sizes:
+        sizes = sizes + [TTA_VIEWS]
+    return sizes
+
+
+class ModelLifecycle:
+    def __init__(self):
+        self.state = STATE_NOT_LOADED
+        self.registry = ModelRegistry()
+        self.error: Optional[str] = None
+        # Load and warmup times per version, so deploys do not hide the startup numbers
+        self.timings: Dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._deploy_lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+
+    def start(self) -> None:
+        """Begin loading in the background (idempotent)"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._load())
+
+    async def wait_ready(self) -> None:
+        self.start()
+        await asyncio.shield(self._task)
+
+    def get_model(self) -> ModelVersion:
+        """The model version that should serve the current request"""
+        if not self.ready:
+            # Lazily kick off loading if the lifespan hook did not
+            self.start()
+            raise ModelNotReadyError(f"Model is not ready ({self.state})")
+        return self.registry.select()
+
+    @property
+    def load_seconds(self) -> Optional[float]:
+        return self.timings.get(settings.ML_MODEL_VERSION, {}).get("load_seconds")
+
+    @property
+    def warmup_seconds(self) -> Optional[float]:
+        return self.timings.get(settings.ML_MODEL_VERSION, {}).get("warmup_seconds")
+
+    def _warmup(self, backend: InferenceBackend) -> None:
+        for batch_size in warmup_batch_sizes():
+            batch = np.zeros((batch_size,) + IMG_SIZE + (3,), dtype=np.float32)
+            backend.predict(batch)
+            if backend.embedding_dim is not None:
+                backend.predict_with_embeddings(batch)
+
+    async def _load_version(self, version: str) -> ModelVersion:
+        started = time.perf_counter()
+        # TensorFlow import and model deserialization happen off the event loop
+        model_version = await asyncio.to_thread(load_model_version, version)
+        timings = {"load_seconds": time.perf_counter() - started, "warmup_seconds": None}
+
+        if settings.ML_WARMUP_ENABLED:
+            if self.state == STATE_LOADING:
+                self.state = STATE_WARMING_UP
+            started = time.perf_counter()
+            await asyncio.to_thread(self._warmup, model_version.backend)
+            if model_version.cascade is not None:
+                await asyncio.to_thread(self._warmup, model_version.cascade)
+            timings["warmup_seconds"] = time.perf_counter() - started
+        self.timings[version] = timings
+        return model_version
+
+    async def deploy(self, version: str, traffic_percent: float = 100.0) -> ModelVersion:
+        """Load and warm up a registry version, then atomically route traffic_percent of requests to it"""
+        async with self._deploy_lock:
+            model_version = self.registry.get_loaded(version)
+            if model_version is None:
+                model_version = await self._load_version(version)
+            self.registry.activate(model_version, traffic_percent)
+        logger.info("ML model version %s now serving %.0f%% of traffic", version, traffic_percent)
+        return model_version
+
+    async def _load(self) -> None:
+        try:
+            self.state = STATE_LOADING
+            model_version = await self._load_version(settings.ML_MODEL_VERSION)
+            self.registry.activate(model_version)
+            self.state = STATE_READY
+            logger.info(
+                "ML model %s ready (%s, load %.1fs)",
+                model_version.version, model_version.backend.name, self.load_seconds
+            )
+        except Exception as e:
+            self.state = STATE_FAILED
+            self.error = str(e)
+            logger.exception("ML model failed to load")
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "backend": settings.ML_BACKEND,
+            "registry": self.registry.status(),
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "version_timings": self.timings,
+            "warmup_batch_sizes": warmup_batch_sizes() if settings.ML_WARMUP_ENABLED else [],
+            "error": self.error,
+        }
+
+
+model_lifecycle = ModelLifecycle()
@@ -0,0 +1,193 @@
+"""
+Fast image preprocessing for the 224x224 plant disease model.
+Large phone JPEGs are decoded at reduced size (DCT-domain downscaling via
+PIL's draft mode) so we never materialize the full-resolution image, then
+resized and normalized into a float32 buffer in a single pass. Buffers can be
+reused across requests through ImageBufferPool. Sources may be bytes or a
+seekable file (e.g. the upload's spooled file), which is decoded in place.
+
+Clients on slow links can instead send a 224x224 WebP/JPEG, or a raw tensor:
+a 12-byte little-endian header (magic "AGRT", height, width, channels as
+uint16/uint16/uint8, dtype uint8 = 0, two zero bytes) followed by exactly
+224*224*3 uint8 RGB bytes. Raw tensors skip decode and resize entirely and
+are viewed in place with np.frombuffer.
+"""
+import io
+import struct
+import threading
+import time
+from typing import BinaryIO, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+IMG_SIZE = (224, 224)
+
+RESAMPLE_FILTERS = {
+    "nearest": Image.NEAREST,  # Matches keras load_img, which the model was trained with
+    "bilinear": Image.BILINEAR,
+    "bicubic": Image.BICUBIC,
+}
+
+_SCALE = np.float32(1.0 / 255.0)
+
+TTA_VIEWS = 8  # Batch size produced by tta_batch
+
+ImageSource = Union[bytes, BinaryIO]
+
+RAW_TENSOR_MAGIC = b"AGRT"
+RAW_TENSOR_HEADER = struct.Struct("<4sHHBB2x")  # magic, height, width, channels, dtype
+RAW_TENSOR_SIZE = RAW_TENSOR_HEADER.size + IMG_SIZE[0] * IMG_SIZE[1] * 3
+
+
+def open_source(source: ImageSource) -> BinaryIO:
+    """A readable stream positioned at the start of the image, without copying file sources"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+def check_raw_tensor_header(header: bytes, total_size: int) -> None:
+    """Strict shape/dtype/length checks for a raw tensor upload; raises ValueError"""
+    if total_size < RAW_TENSOR_HEADER.size:
+        raise ValueError("Raw tensor header is truncated")
+    magic, height, width, channels, dtype = RAW_TENSOR_HEADER.unpack_from(header)
+    if magic != RAW_TENSOR_MAGIC:
+        raise ValueError("Not a raw tensor upload")
+    if (height, width, channels) != IMG_SIZE + (3,):
+        raise ValueError(f"Raw tensor must be {IMG_SIZE[0]}x{IMG_SIZE[1]}x3, got {height}x{width}x{channels}")
+    if dtype != 0:
+        raise ValueError(f"Raw tensor dtype must be uint8 (0), got {dtype}")
+    if total_size != RAW_TENSOR_SIZE:
+        raise ValueError(f"Raw tensor upload must be exactly {RAW_TENSOR_SIZE} bytes, got {total_size}")
+
+
+def raw_tensor_content(source: ImageSource) -> Optional[bytes]:
+    """The whole upload if it is a raw tensor, else None (only the magic is read from files)"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source if bytes(source[:len(RAW_TENSOR_MAGIC)]) == RAW_TENSOR_MAGIC else None
+    stream = open_source(source)
+    is_raw = stream.read(len(RAW_TENSOR_MAGIC)) == RAW_TENSOR_MAGIC
+    stream.seek(0)
+    return stream.read() if is_raw else None
+
+
+def raw_tensor_pixels(content: bytes) -> np.ndarray:
+    """Zero-copy (224, 224, 3) uint8 view of a validated raw tensor upload"""
+    check_raw_tensor_header(content[:RAW_TENSOR_HEADER.size], len(content))
+    return np.frombuffer(content, dtype=np.uint8, offset=RAW_TENSOR_HEADER.size).reshape(IMG_SIZE + (3,))
+
+
+def encode_raw_tensor(pixels: np.ndarray) -> bytes:
+    """Client-side encoding of a (224, 224, 3) uint8 RGB array as a raw tensor upload"""
+    if pixels.shape != IMG_SIZE + (3,) or pixels.dtype != np.uint8:
+        raise ValueError(f"Expected a {IMG_SIZE[0]}x{IMG_SIZE[1]}x3 uint8 array")
+    return RAW_TENSOR_HEADER.pack(RAW_TENSOR_MAGIC, IMG_SIZE[0], IMG_SIZE[1], 3, 0) + pixels.tobytes()
+
+
+def preprocess_image(
+    source: ImageSource,
+    out: Optional[np.ndarray] = None,
+    resample: str = "nearest"
+) -> Tuple[np.ndarray, dict]:
+    """Decode image bytes or a file into a (224, 224, 3) float32 array in [0, 1], returning per-stage timings in ms"""
+    started = time.perf_counter()
+    raw = raw_tensor_content(source)
+    if raw is not None:
+        # Already 224x224 RGB: no decode or resize
+        pixels = raw_tensor_pixels(raw)
+        decoded = resized = time.perf_counter()
+    else:
+        with Image.open(open_source(source)) as img:
+            # For JPEGs this picks the largest 1/2, 1/4 or 1/8 DCT scale that stays >= 224px
+            img.draft("RGB", IMG_SIZE)
+            img = img.convert("RGB")
+        decoded = time.perf_counter()
+
+        # Client-resized 224x224 WebP/JPEG uploads skip this
+        if img.size != IMG_SIZE:
+            img = img.resize(IMG_SIZE, RESAMPLE_FILTERS[resample])
+        pixels = np.asarray(img, dtype=np.uint8)
+        resized = time.perf_counter()
+
+    if out is None:
+        out = np.empty(IMG_SIZE + (3,), dtype=np.float32)
+    np.multiply(pixels, _SCALE, out=out, casting="unsafe")  # uint8 -> normalized float32 in one pass
+    normalized = time.perf_counter()
+
+    return out, {
+        "decode": (decoded - started) * 1000.0,
+        "resize": (resized - decoded) * 1000.0,
+        "normalize": (normalized - resized) * 1000.0,
+    }
+
+
+def tta_batch(img_array: np.ndarray, crop_fraction: float = 0.875) -> np.ndarray:
+    """Test-time augmentation views of one preprocessed image as a single batch: the image itself,
+    horizontal and vertical flips, and center/corner crops resized back to 224x224 (nearest)"""
+    height, width = IMG_SIZE
+    crop_height, crop_width = int(height * crop_fraction), int(width * crop_fraction)
+    rows = np.arange(height) * crop_height // height
+    cols = np.arange(width) * crop_width // width
+    crop_offsets = [
+        ((height - crop_height) // 2, (width - crop_width) // 2),
+        (0, 0),
+        (0, width - crop_width),
+        (height - crop_height, 0),
+        (height - crop_height, width - crop_width),
+    ]
+
+    batch = np.empty((TTA_VIEWS,) + IMG_SIZE + (3,), dtype=np.float32)
+    batch[0] = img_array
+    batch[1] = img_array[:, ::-1]
+    batch[2] = img_array[::-1]
+    for i, (top, left) in enumerate(crop_offsets, start=3):
+        batch[i] = img_array[np.ix_(top + rows, left + cols)]
+    return batch
+
+
+class ImageBufferPool:
+    """Reusable (224, 224, 3) float32 buffers so steady-state requests do not allocate"""
+
+    def __init__(self, max_buffers: int = 32):
+        self.max_buffers = max_buffers
+        self._free = []
+        self._lock = threading.Lock()
+        self.allocations = 0
+
+    def acquire(self) -> np.ndarray:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocations += 1
+        return np.empty(IMG_SIZE + (3,), dtype=np.float32)
+
+    def release(self, buffer: np.ndarray) -> None:
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buffer)
+
+    def stats(self) -> dict:
+        return {"free": len(self._free), "allocations": self.allocations, "max_buffers": self.max_buffers}
+
+
+class StageTimings:
+    """Thread-safe running totals of per-stage latencies (decode, resize, normalize, model, ...)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, timings: dict) -> None:
+        with self._lock:
+            for stage, ms in timings.items():
+                count, total, worst = self._stages.get(stage, (0, 0.0, 0.0))
+                self._stages[stage] = (count + 1, total + ms, max(worst, ms))
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                stage: {"count": count, "avg_ms": total / count, "max_ms": worst}
+                for stage, (count, total, worst) in self._stages.items()
+            }
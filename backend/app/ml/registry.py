@@ -0,0 +1,176 @@
+"""
+Versioned model registry.
+Each version lives in its own directory under ML_MODEL_REGISTRY_DIR:
+
+    <registry dir>/<version>/plant_disease_model.h5   (plus any converted .tflite files)
+    <registry dir>/<version>/plant_disease_model_small.h5   (optional cascade model)
+    <registry dir>/<version>/class_names.json
+
+Requests pick a ModelVersion with select() and keep that reference until
+they finish, so swapping the active version never disturbs in-flight work.
+A second version can receive a percentage of traffic for canary rollouts.
+"""
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.core.config import get_settings
+from .backends import InferenceBackend, configure_tf_threads, load_backend
+from .constants import class_names as default_class_names
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+MODEL_FILENAME = "plant_disease_model.h5"
+CASCADE_MODEL_FILENAME = "plant_disease_model_small.h5"
+CLASS_NAMES_FILENAME = "class_names.json"
+
+# Versions name directories, so they are limited to plain file name characters
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+class ModelVersion:
+    def __init__(
+        self,
+        version: str,
+        backend: InferenceBackend,
+        class_names: List[str],
+        source: str,
+        cascade: Optional[InferenceBackend] = None
+    ):
+        self.version = version
+        self.backend = backend
+        self.class_names = class_names
+        self.source = source
+        # Small first-stage model; None when the cascade is disabled or not shipped for this version
+        self.cascade = cascade
+        self.loaded_at = time.time()
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "backend": self.backend.name,
+            "num_classes": len(self.class_names),
+            "source": self.source,
+            "cascade": self.cascade.name if self.cascade else None,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def available_versions() -> List[str]:
+    registry_dir = settings.ML_MODEL_REGISTRY_DIR
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(registry_dir)
+        if os.path.isfile(os.path.join(registry_dir, name, MODEL_FILENAME))
+    )
+
+
+def load_model_version(version: str) -> ModelVersion:
+    """Load a version's model and class names (blocking; run off the event loop)"""
+    version_dir = _version_dir(version)
+    if os.path.isfile(os.path.join(version_dir, MODEL_FILENAME)):
+        model_path = os.path.join(version_dir, MODEL_FILENAME)
+        cascade_path = os.path.join(version_dir, CASCADE_MODEL_FILENAME)
+        with open(os.path.join(version_dir, CLASS_NAMES_FILENAME)) as f:
+            class_names = json.load(f)
+    elif version == settings.ML_MODEL_VERSION:
+        # Unversioned deployment: the single model at ML_MODEL_PATH with the built-in class list
+        model_path = settings.ML_MODEL_PATH
+        cascade_path = settings.ML_CASCADE_MODEL_PATH
+        class_names = list(default_class_names)
+    else:
+        raise FileNotFoundError(f"Model version '{version}' not found in {settings.ML_MODEL_REGISTRY_DIR}")
+
+    # Only the first load (at startup) can set the thread pools; later deploys skip this
+    configure_tf_threads(settings.ML_TF_INTRA_OP_THREADS, settings.ML_TF_INTER_OP_THREADS)
+    embedding_layer = settings.ML_EMBEDDING_LAYER if settings.ML_EMBEDDINGS_ENABLED else None
+    backend = _load_backend(model_path, embedding_layer)
+
+    cascade = None
+    if settings.ML_CASCADE_ENABLED:
+        if os.path.isfile(cascade_path):
+            cascade = _load_backend(cascade_path)
+        else:
+            logger.warning("Cascade enabled but %s not found; version %s serves the full model only", cascade_path, version)
+    return ModelVersion(version, backend, class_names, model_path, cascade)
+
+
+def _version_dir(version: str) -> str:
+    """The version's directory, refusing names that could point outside the registry"""
+    if not VERSION_PATTERN.match(version) or version in (".", ".."):
+        raise ValueError(f"Invalid model version '{version}'")
+    registry_dir = os.path.realpath(settings.ML_MODEL_REGISTRY_DIR)
+    version_dir = os.path.realpath(os.path.join(registry_dir, version))
+    if os.path.dirname(version_dir) != registry_dir:
+        raise ValueError(f"Invalid model version '{version}'")
+    return version_dir
+
+
+def _load_backend(model_path: str, embedding_layer: Optional[str] = None) -> InferenceBackend:
+    return load_backend(
+        settings.ML_BACKEND,
+        model_path,
+        num_threads=settings.ML_TFLITE_NUM_THREADS,
+        compiled=settings.ML_KERAS_COMPILED,
+        jit_compile=settings.ML_XLA_JIT,
+        embedding_layer=embedding_layer
+    )
+
+
+class ModelRegistry:
+    """Active version plus an optional canary version receiving traffic_percent of requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (active, canary, canary_percent), replaced as a whole so readers never see a half-applied swap
+        self._routing = (None, None, 0.0)
+        self._requests: Dict[str, int] = {}
+
+    @property
+    def active(self) -> Optional[ModelVersion]:
+        return self._routing[0]
+
+    def get_loaded(self, version: str) -> Optional[ModelVersion]:
+        """The already-loaded active or canary ModelVersion with this version name, if any"""
+        active, canary, _ = self._routing
+        for model_version in (active, canary):
+            if model_version is not None and model_version.version == version:
+                return model_version
+        return None
+
+    def activate(self, model_version: ModelVersion, traffic_percent: float = 100.0) -> None:
+        """Atomically route traffic_percent of requests to model_version (100 = promote to active)"""
+        with self._lock:
+            active = self._routing[0]
+            if traffic_percent >= 100.0 or active is None:
+                self._routing = (model_version, None, 0.0)
+            elif traffic_percent <= 0.0 or model_version is active:
+                self._routing = (active, None, 0.0)
+            else:
+                self._routing = (active, model_version, traffic_percent)
+
+    def select(self) -> Optional[ModelVersion]:
+        """Pick the version serving this request"""
+        active, canary, percent = self._routing
+        chosen = canary if canary is not None and random.random() * 100.0 < percent else active
+        if chosen is not None:
+            self._requests[chosen.version] = self._requests.get(chosen.version, 0) + 1
+        return chosen
+
+    def status(self) -> dict:
+        active, canary, percent = self._routing
+        return {
+            "active": active.info() if active else None,
+            "canary": canary.info() if canary else None,
+            "canary_traffic_percent": percent,
+            "requests_by_version": dict(self._requests),
+            "available_versions": available_versions(),
+        }
@@ -1,22 +1,370 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
-from .utils import predict_disease
-from .constants import class_names
-import tensorflow as tf
+import asyncio
+import json
+import logging
+import time
+from typing import List
+from typing import Optional
+from fastapi import APIRouter, File, Header, UploadFile, HTTPException
+from fastapi.responses import StreamingResponse
+from app.core.config import get_settings
+from .utils import decode_prediction, is_zip_upload, extract_zip_images
+from .preprocessing import preprocess_image, tta_batch, ImageBufferPool, ImageSource, StageTimings
+from .batching import MicroBatcher
+from .executor import InferenceExecutor
+from .cache import PredictionCache, content_digest, perceptual_hash
+from .uploads import UploadRejected, sniff_image, upload_stats
+from .lifecycle import model_lifecycle, ModelNotReadyError
+from .vectors import VectorStore
+from . import schemas
+import numpy as np
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-model = tf.keras.models.load_model("app/ml/models/plant_disease_model.h5")
+ml_executor = InferenceExecutor(
+    max_workers=settings.ML_EXECUTOR_MAX_WORKERS,
+    timeout=settings.ML_REQUEST_TIMEOUT_SECONDS,
+    process_workers=settings.ML_EXECUTOR_PROCESS_WORKERS
+)
+
+stage_timings = StageTimings()
+image_buffers = ImageBufferPool(max_buffers=settings.ML_MAX_BATCH_SIZE * 2)
+
+batcher = MicroBatcher(
+    max_batch_size=settings.ML_MAX_BATCH_SIZE,
+    max_wait_ms=settings.ML_MAX_BATCH_WAIT_MS,
+    executor=ml_executor,
+    timings=stage_timings
+)
+
+prediction_cache = PredictionCache(
+    namespace=settings.ML_BACKEND,
+    max_entries=settings.ML_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ML_CACHE_TTL_SECONDS,
+    perceptual=settings.ML_CACHE_PERCEPTUAL,
+    max_hash_distance=settings.ML_CACHE_PHASH_MAX_DISTANCE
+)
+
+# Which cascade stage answered each uncached prediction
+STAGE_SMALL = "small"
+STAGE_FULL = "full"
+cascade_counts = {STAGE_SMALL: 0, STAGE_FULL: 0}
+
+# Test-time augmentation runs and how often they changed the predicted class
+tta_counts = {"runs": 0, "changed_class": 0, "total_ms": 0.0}
+
+# Response fields describing this request only; cached results do not replay them. case_id is
+# cached: a repeated upload points at the case recorded the first time, for /ml/similar
+_PER_REQUEST_FIELDS = {"tta_applied": False, "tta_latency_ms": None}
+
+# Past diagnoses for /ml/similar; created on disk with the first captured embedding
+embedding_store = VectorStore(settings.ML_EMBEDDINGS_DIR) if settings.ML_EMBEDDINGS_ENABLED else None
+
+def _predict_single(backend, class_names, img_array: np.ndarray, with_embedding: bool = False):
+    started = time.perf_counter()
+    batch = np.expand_dims(img_array, 0)
+    if with_embedding:
+        predictions, embeddings = backend.predict_with_embeddings(batch)
+    else:
+        predictions = backend.predict(batch)
+    stage_timings.record({"model": (time.perf_counter() - started) * 1000.0})
+    result = decode_prediction(predictions[0], class_names)
+    return result + (embeddings[0],) if with_embedding else result
+
+def _predict_tta(backend, class_names, img_array: np.ndarray):
+    """Average the softmax over all augmented views, computed in one forward pass"""
+    predictions = backend.predict(tta_batch(img_array, settings.ML_TTA_CROP_FRACTION))
+    return decode_prediction(predictions.mean(axis=0), class_names)
+
+async def _run_model(
+    backend,
+    class_names,
+    img_array: np.ndarray,
+    batched: bool,
+    deadline: float,
+    with_embedding: bool = False
+):
+    if batched:
+        return await asyncio.wait_for(
+            batcher.submit(img_array, backend, class_names, with_embedding),
+            max(0.0, deadline - time.monotonic())
+        )
+    return await ml_executor.run(_predict_single, backend, class_names, img_array, with_embedding, deadline=deadline)
+
+def _inspect_upload(source: ImageSource, with_digest: bool):
+    """Header-only format/dimension checks, plus the content digest for the cache key"""
+    _, _, _, decode_bytes = sniff_image(source, settings.ML_ALLOWED_IMAGE_FORMATS, settings.ML_MAX_IMAGE_PIXELS)
+    return decode_bytes, content_digest(source) if with_digest else None
+
+async def _predict_content(source: ImageSource, batched: bool):
+    """Predict image bytes or a seekable file, consulting the prediction cache first.
+    Returns the response fields: predicted_class, confidence, model_version, model_stage,
+    tta_applied, tta_latency_ms and case_id."""
+    # The selected version is held for the whole request, so a hot swap never affects it
+    model = model_lifecycle.get_model()
+    # One deadline for the whole request, shared by every executor call it makes
+    deadline = time.monotonic() + settings.ML_REQUEST_TIMEOUT_SECONDS
+    decode_bytes, digest = await ml_executor.run(_inspect_upload, source, settings.ML_CACHE_ENABLED, deadline=deadline)
+    upload_stats.add_decode_bytes(decode_bytes)
+    try:
+        return await _predict_checked(model, source, digest, batched, deadline)
+    finally:
+        upload_stats.add_decode_bytes(-decode_bytes)
+
+async def _predict_checked(model, source: ImageSource, digest: Optional[str], batched: bool, deadline: float):
+    cache_key = phash = None
+    if digest is not None:
+        cache_key = prediction_cache.make_key(digest, model.version)
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            return {**cached, **_PER_REQUEST_FIELDS}
+        if prediction_cache.perceptual:
+            phash = await ml_executor.run_cpu(perceptual_hash, source, deadline=deadline)
+            cached = prediction_cache.get_similar(phash, model.version)
+            if cached is not None:
+                return {**cached, **_PER_REQUEST_FIELDS}
+
+    if ml_executor.process_workers:
+        # Buffers cannot be shared with worker processes
+        buffer = None
+        img_array, timings = await ml_executor.run_cpu(
+            preprocess_image, source, None, settings.ML_RESIZE_FILTER, deadline=deadline
+        )
+    else:
+        buffer = image_buffers.acquire()
+        # If decoding times out the buffer is dropped, since the worker thread may still write to it
+        img_array, timings = await ml_executor.run(
+            preprocess_image, source, buffer, settings.ML_RESIZE_FILTER, deadline=deadline
+        )
+    stage_timings.record(timings)
+
+    # Embeddings come from the full model only, so cases answered by the small model are not indexed
+    capture = embedding_store is not None and model.backend.embedding_dim is not None
+    embedding = case_id = None
+    tta_ms = None
+    try:
+        stage = STAGE_FULL
+        if model.cascade is not None:
+            # Clear cases are answered by the small model; only doubtful ones reach the full model
+            predicted_class, confidence = await _run_model(
+                model.cascade, model.class_names, img_array, batched, deadline
+            )
+            if confidence >= settings.ML_CASCADE_THRESHOLD:
+                stage = STAGE_SMALL
+        if stage == STAGE_FULL:
+            prediction = await _run_model(model.backend, model.class_names, img_array, batched, deadline, capture)
+            predicted_class, confidence = prediction[:2]
+            if capture:
+                embedding = prediction[2]
+        cascade_counts[stage] += 1
+
+        if settings.ML_TTA_ENABLED and confidence < settings.ML_TTA_THRESHOLD:
+            # Spend one extra batched forward pass on the full model rather than return a doubtful answer
+            started = time.perf_counter()
+            tta_class, confidence = await ml_executor.run(
+                _predict_tta, model.backend, model.class_names, img_array, deadline=deadline
+            )
+            tta_ms = (time.perf_counter() - started) * 1000.0
+            tta_counts["runs"] += 1
+            tta_counts["changed_class"] += tta_class != predicted_class
+            tta_counts["total_ms"] += tta_ms
+            predicted_class = tta_class
+    finally:
+        if buffer is not None:
+            image_buffers.release(buffer)
+
+    if embedding is not None:
+        # Recorded with the diagnosis actually returned, after TTA
+        try:
+            case_id = embedding_store.add(embedding, predicted_class, float(confidence), model.version)
+        except (OSError, ValueError):
+            logger.warning("Could not record the case for similar-case search", exc_info=True)
+
+    result = {
+        "predicted_class": predicted_class,
+        "confidence": float(confidence),
+        "model_version": model.version,
+        "model_stage": stage,
+        "tta_applied": tta_ms is not None,
+        "tta_latency_ms": tta_ms,
+        "case_id": case_id
+    }
+    if cache_key is not None:
+        cached = {field: value for field, value in result.items() if field not in _PER_REQUEST_FIELDS}
+        prediction_cache.put(cache_key, model.version, cached, phash)
+    return result
+
+async def startup():
+    """Load and warm up the model in the background; /ready turns healthy when done"""
+    model_lifecycle.start()
+
+async def shutdown():
+    """Stop the batching worker and release executor threads/processes"""
+    await batcher.stop()
+    ml_executor.shutdown()
 
 @router.post("/predict")
 async def predict_disease_endpoint(file: UploadFile = File(...)):
+    """Diagnose a leaf photo, a client-resized 224x224 WebP/JPEG or a raw 224x224x3 uint8 tensor"""
     try:
-        predicted_class, confidence = predict_disease(file, model, class_names)
-        return {
-            "predicted_class": predicted_class,
-            "confidence": float(confidence),
-            "success": True
-        }
+        # Oversized bodies were already rejected by UploadLimitMiddleware while streaming.
+        # Decode straight from the spooled upload file; worker processes need the bytes.
+        source = await file.read() if ml_executor.process_workers else file.file
+        result = await _predict_content(source, settings.ML_BATCHING_ENABLED)
+        return {**result, "success": True}
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Prediction timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+async def _predict_one(index: int, filename: str, content: bytes) -> dict:
+    result = {"index": index, "filename": filename}
+    try:
+        # Concurrent submissions are vectorized into shared model calls by the batcher
+        result.update(await _predict_content(content, batched=True), success=True)
+    except UploadRejected as e:
+        result.update(success=False, error=e.detail)
+    except asyncio.TimeoutError:
+        result.update(success=False, error="Prediction timed out")
+    except Exception as e:
+        result.update(success=False, error=f"Prediction failed: {str(e)}")
+    return result
+
+@router.post("/predict/batch")
+async def predict_disease_batch_endpoint(files: List[UploadFile] = File(...)):
+    """Predict many images (multipart files and/or zip archives), streaming NDJSON results as they complete"""
+    try:
+        model_lifecycle.get_model()
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    images = []
+    try:
+        for file in files:
+            content = await file.read()
+            if is_zip_upload(file.filename, file.content_type):
+                remaining = settings.ML_BATCH_MAX_IMAGES - len(images)
+                images.extend(await ml_executor.run(
+                    extract_zip_images, content, remaining, settings.ML_MAX_UPLOAD_BYTES
+                ))
+            elif len(content) > settings.ML_MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"{file.filename} is too large")
+            else:
+                images.append((file.filename, content))
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid upload: {str(e)}")
+
+    if not images:
+        raise HTTPException(status_code=400, detail="No images provided")
+    if len(images) > settings.ML_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Too many images (max {settings.ML_BATCH_MAX_IMAGES})")
 
+    async def stream_results():
+        tasks = [
+            asyncio.ensure_future(_predict_one(index, filename, content))
+            for index, (filename, content) in enumerate(images)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # Stop outstanding work if the client disconnects mid-stream
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@router.get("/stats")
+async def inference_stats():
+    """Micro-batching, cascade, TTA, executor, prediction cache, upload memory and per-stage latency statistics"""
+    answered = sum(cascade_counts.values())
+    return {
+        "model": model_lifecycle.status(),
+        "batching_enabled": settings.ML_BATCHING_ENABLED,
+        "batcher": batcher.stats(),
+        "cascade": {
+            "enabled": settings.ML_CASCADE_ENABLED,
+            "threshold": settings.ML_CASCADE_THRESHOLD,
+            "answered_by": dict(cascade_counts),
+            "small_rate": cascade_counts[STAGE_SMALL] / answered if answered else 0.0
+        },
+        "tta": {
+            "enabled": settings.ML_TTA_ENABLED,
+            "threshold": settings.ML_TTA_THRESHOLD,
+            "runs": tta_counts["runs"],
+            "changed_class": tta_counts["changed_class"],
+            "avg_latency_ms": tta_counts["total_ms"] / tta_counts["runs"] if tta_counts["runs"] else 0.0
+        },
+        "executor": ml_executor.stats(),
+        "cache": prediction_cache.stats() if settings.ML_CACHE_ENABLED else None,
+        "stages": stage_timings.summary(),
+        "image_buffers": image_buffers.stats(),
+        "uploads": upload_stats.stats(),
+        "embeddings": embedding_store.stats() if embedding_store is not None else None
+    }
+
+@router.get("/similar")
+async def similar_cases(case_id: int, k: int = 10, same_version: bool = True, exact: bool = False):
+    """Nearest previously diagnosed leaves to a past prediction (case_id from /ml/predict)"""
+    if embedding_store is None:
+        raise HTTPException(status_code=404, detail="Similar-case search is not enabled")
+    k = max(1, min(k, settings.ML_SIMILAR_MAX_K))
+    try:
+        query, case = embedding_store.case(case_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Case {case_id} not found")
+
+    started = time.perf_counter()
+    # Embeddings from different model versions live in different spaces
+    neighbours, method = await ml_executor.run(
+        embedding_store.search,
+        query,
+        k,
+        case["model_version"] if same_version else None,
+        case_id,
+        settings.ML_SIMILAR_NPROBE,
+        exact
+    )
+    search_ms = (time.perf_counter() - started) * 1000.0
+    return {
+        "case": case,
+        "results": [{**embedding_store.case(neighbour)[1], "similarity": score} for neighbour, score in neighbours],
+        "method": method,
+        "search_ms": search_ms
+    }
+
+def _require_admin(x_admin_token: Optional[str]):
+    if not settings.ML_ADMIN_TOKEN or x_admin_token != settings.ML_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model management is not allowed")
+
+@router.get("/models")
+async def list_models(x_admin_token: Optional[str] = Header(None)):
+    """Active/canary model versions, traffic split and versions available in the registry"""
+    _require_admin(x_admin_token)
+    return model_lifecycle.registry.status()
+
+@router.post("/models/deploy")
+async def deploy_model(request: schemas.DeployModelRequest, x_admin_token: Optional[str] = Header(None)):
+    """Load and warm up a model version, then route traffic_percent of requests to it without a restart"""
+    _require_admin(x_admin_token)
+    if not model_lifecycle.ready:
+        raise HTTPException(status_code=503, detail=f"Model is not ready ({model_lifecycle.state})")
+    try:
+        await model_lifecycle.deploy(request.version, request.traffic_percent)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Deploy failed: {str(e)}")
+    return model_lifecycle.registry.status()
@@ -0,0 +1,5 @@
+from pydantic import BaseModel, Field
+
+class DeployModelRequest(BaseModel):
+    version: str
+    traffic_percent: float = Field(100.0, ge=0.0, le=100.0)
@@ -0,0 +1,204 @@
+"""
+Size-bounded upload handling for the image endpoints.
+UploadLimitMiddleware rejects oversized bodies with 413 while they are still
+streaming (or straight away from Content-Length), before the multipart parser
+spools them. sniff_image() reads only the image header to check format and
+dimensions before any pixels are decoded. UploadStats tracks the bytes held
+by in-flight requests so per-request memory shows up in /ml/stats.
+"""
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+from PIL import Image, UnidentifiedImageError
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .preprocessing import (
+    IMG_SIZE,
+    RAW_TENSOR_HEADER,
+    RAW_TENSOR_MAGIC,
+    ImageSource,
+    check_raw_tensor_header,
+    open_source,
+)
+
+RAW_FORMAT = "RAW"
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadStats:
+    """Gauges for request bodies and decode buffers held by in-flight requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight_requests = 0
+        self.in_flight_body_bytes = 0
+        self.in_flight_decode_bytes = 0
+        self.peak_in_flight_bytes = 0
+        self.peak_request_bytes = 0
+        self.rejected_too_large = 0
+        self.rejected_invalid = 0
+
+    def _update_peak(self) -> None:
+        self.peak_in_flight_bytes = max(
+            self.peak_in_flight_bytes, self.in_flight_body_bytes + self.in_flight_decode_bytes
+        )
+
+    def begin_request(self) -> None:
+        with self._lock:
+            self.in_flight_requests += 1
+
+    def add_body_bytes(self, count: int) -> None:
+        with self._lock:
+            self.in_flight_body_bytes += count
+            self._update_peak()
+
+    def end_request(self, body_bytes: int) -> None:
+        with self._lock:
+            self.in_flight_requests -= 1
+            self.in_flight_body_bytes -= body_bytes
+            self.peak_request_bytes = max(self.peak_request_bytes, body_bytes)
+
+    def add_decode_bytes(self, count: int) -> None:
+        with self._lock:
+            self.in_flight_decode_bytes += count
+            self._update_peak()
+
+    def reject(self, too_large: bool) -> None:
+        with self._lock:
+            if too_large:
+                self.rejected_too_large += 1
+            else:
+                self.rejected_invalid += 1
+
+    def stats(self) -> dict:
+        in_flight_bytes = self.in_flight_body_bytes + self.in_flight_decode_bytes
+        return {
+            "in_flight_requests": self.in_flight_requests,
+            "in_flight_body_bytes": self.in_flight_body_bytes,
+            "in_flight_decode_bytes": self.in_flight_decode_bytes,
+            "bytes_per_in_flight_request": in_flight_bytes / self.in_flight_requests if self.in_flight_requests else 0,
+            "peak_in_flight_bytes": self.peak_in_flight_bytes,
+            "peak_request_body_bytes": self.peak_request_bytes,
+            "rejected_too_large": self.rejected_too_large,
+            "rejected_invalid": self.rejected_invalid,
+            "process_rss_bytes": process_rss_bytes(),
+        }
+
+
+upload_stats = UploadStats()
+
+
+def process_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class UploadLimitMiddleware:
+    """Enforce a maximum request body size per path while the body streams in"""
+
+    def __init__(self, app: ASGIApp, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            # Reject before reading a single body byte
+            upload_stats.reject(too_large=True)
+            await _send_too_large(send, limit)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = len(message.get("body", b""))
+                received += chunk
+                upload_stats.add_body_bytes(chunk)
+                if received > limit:
+                    upload_stats.reject(too_large=True)
+                    raise HTTPException(status_code=413, detail=_too_large_detail(limit))
+            return message
+
+        upload_stats.begin_request()
+        try:
+            await self.app(scope, limited_receive, send)
+        finally:
+            upload_stats.end_request(received)
+
+
+def _too_large_detail(limit: int) -> str:
+    return f"Upload too large (max {limit} bytes)"
+
+
+async def _send_too_large(send: Send, limit: int) -> None:
+    body = ('{"detail": "%s"}' % _too_large_detail(limit)).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def sniff_image(source: ImageSource, allowed_formats: Iterable[str], max_pixels: int) -> Tuple[str, int, int, int]:
+    """Read only the image header; return (format, width, height, estimated decode bytes)"""
+    stream = open_source(source)
+    header = stream.read(RAW_TENSOR_HEADER.size)
+    if header.startswith(RAW_TENSOR_MAGIC):
+        return _sniff_raw_tensor(stream, header, allowed_formats)
+
+    stream.seek(0)
+    try:
+        with Image.open(stream) as img:
+            image_format, (width, height) = img.format, img.size
+            # Size after the reduced-size JPEG decode used by preprocess_image
+            if image_format == "JPEG":
+                img.draft("RGB", IMG_SIZE)
+            decode_width, decode_height = img.size
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        upload_stats.reject(too_large=False)
+        raise UploadRejected(415, "Unsupported or corrupt image")
+    finally:
+        stream.seek(0)
+
+    if image_format not in allowed_formats:
+        upload_stats.reject(too_large=False)
+        raise UploadRejected(415, f"Unsupported image format {image_format} (allowed: {', '.join(allowed_formats)})")
+    if width * height > max_pixels:
+        upload_stats.reject(too_large=True)
+        raise UploadRejected(413, f"Image dimensions too large ({width}x{height})")
+    return image_format, width, height, decode_width * decode_height * 3
+
+
+def _sniff_raw_tensor(stream, header: bytes, allowed_formats: Iterable[str]) -> Tuple[str, int, int, int]:
+    total_size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    if RAW_FORMAT not in allowed_formats:
+        upload_stats.reject(too_large=False)
+        raise UploadRejected(415, "Raw tensor uploads are not enabled")
+    try:
+        check_raw_tensor_header(header, total_size)
+    except ValueError as e:
+        upload_stats.reject(too_large=False)
+        raise UploadRejected(400, f"Invalid raw tensor upload: {e}")
+    # Viewed in place, nothing is decoded
+    return RAW_FORMAT, IMG_SIZE[1], IMG_SIZE[0], 0
@@ -1,22 +1,35 @@
-import tensorflow as tf
 import numpy as np
-from tensorflow.keras.preprocessing import image
 import io
+import zipfile
+from .preprocessing import preprocess_image
 
-def predict_disease(file, model, class_names):
-    # Convert UploadFile to BytesIO for image loading
-    file_content = file.file.read()
-    file.file.seek(0)  # Reset file pointer for potential future reads
-    
-    img = image.load_img(io.BytesIO(file_content), target_size=(224, 224))
-    img_array = image.img_to_array(img)
-    img_array = tf.expand_dims(img_array, 0)  # Create batch axis
-    img_array = img_array / 255.0  # Normalize to [0,1]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
 
-    predictions = model.predict(img_array)
-    predicted_index = np.argmax(predictions[0])
-    confidence = np.max(predictions[0])
+def load_image_array(file_content: bytes) -> np.ndarray:
+    """Decode raw image bytes into a normalized (224, 224, 3) float32 array"""
+    img_array, _ = preprocess_image(file_content)
+    return img_array
 
-    predicted_class = class_names[predicted_index]
+def decode_prediction(prediction, class_names):
+    """Turn one row of softmax output into (predicted_class, confidence)"""
+    predicted_index = np.argmax(prediction)
+    confidence = np.max(prediction)
+    return class_names[predicted_index], confidence
 
-    return predicted_class, confidence
\ No newline at end of file
+def is_zip_upload(filename: str, content_type: str) -> bool:
+    return content_type in ("application/zip", "application/x-zip-compressed") or (filename or "").lower().endswith(".zip")
+
+def extract_zip_images(zip_content: bytes, max_images: int, max_image_bytes: int = None):
+    """Return (name, bytes) for each image in a zip archive, skipping directories and non-image members"""
+    images = []
+    with zipfile.ZipFile(io.BytesIO(zip_content)) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if len(images) >= max_images:
+                raise ValueError(f"Too many images in archive (max {max_images})")
+            # Checked from the central directory so oversized members are never inflated
+            if max_image_bytes is not None and info.file_size > max_image_bytes:
+                raise ValueError(f"Archive member {info.filename} is too large")
+            images.append((info.filename, archive.read(info)))
+    return images
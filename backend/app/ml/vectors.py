@@ -0,0 +1,360 @@
+"""
+Append-only, memory-mapped store of prediction embeddings for similar-case search.
+Layout under ML_EMBEDDINGS_DIR:
+
+    store.json    {"dim": 128}
+    vectors.f32   L2-normalized float32 rows, one per case
+    meta.bin      fixed-size records: predicted class, confidence, model version, created_at
+    ivf/          optional IVF index (python -m app.ml.vectors build-index)
+
+Row numbers are case ids. Every uvicorn worker appends to the same files,
+so an append holds an exclusive flock on vectors.f32 and takes its case id
+from the file size under that lock. Readers count only rows present in
+both files, so a row whose meta record is still being written is invisible.
+
+Exact search is a chunked matrix-vector product
+over the memmap. With an IVF index, only the nprobe lists whose centroids are
+closest to the query are scored, plus any rows appended since the index was
+built, so search stays in the milliseconds at millions of rows.
+
+Usage (from the backend directory):
+    python -m app.ml.vectors stats
+    python -m app.ml.vectors build-index --nlist 1024
+"""
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+META_DTYPE = np.dtype([
+    ("predicted_class", "S48"),
+    ("confidence", "<f4"),
+    ("model_version", "S64"),
+    ("created_at", "<f8"),
+])
+
+_SEARCH_CHUNK_ROWS = 65536
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def _top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[keep], scores[keep]
+    order = np.argsort(-scores, kind="stable")
+    return ids[order], scores[order]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by cosine) for every row, in chunks to bound memory"""
+    return np.concatenate([
+        np.argmax(vectors[start:start + _SEARCH_CHUNK_ROWS] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), _SEARCH_CHUNK_ROWS)
+    ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+
+def _spherical_kmeans(data: np.ndarray, nlist: int, iterations: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=nlist)
+        # Empty lists keep their previous centroid
+        centroids = np.where(counts[:, None] > 0, _normalize(sums), centroids)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index: row ids grouped by nearest k-means centroid"""
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, rows: int):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.rows = rows
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: int, iterations: int = 10, sample: int = 65536) -> "IVFIndex":
+        rows = len(vectors)
+        nlist = max(1, min(nlist, rows))
+        rng = np.random.default_rng(0)
+        training = vectors[np.sort(rng.choice(rows, min(sample, rows), replace=False))]
+        centroids = _spherical_kmeans(np.asarray(training), nlist, iterations)
+        assignments = _assign(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+        return cls(centroids, order, offsets, rows)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = min(nprobe, self.nlist)
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        ids = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+        ids.sort()  # Sequential memmap access
+        return ids
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        np.save(os.path.join(directory, "order.npy"), self.order)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump({"rows": self.rows, "nlist": self.nlist, "built_at": time.time()}, f)
+
+    @classmethod
+    def load(cls, directory: str) -> "IVFIndex":
+        with open(os.path.join(directory, "index.json")) as f:
+            rows = json.load(f)["rows"]
+        return cls(
+            np.load(os.path.join(directory, "centroids.npy")),
+            np.load(os.path.join(directory, "order.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "offsets.npy")),
+            rows
+        )
+
+
+class VectorStore:
+    """Append-only embedding store; created on the first add, reopened from disk afterwards.
+    With read_only=True nothing is created, repaired or appended (for inspecting a live store)."""
+
+    def __init__(self, directory: str, read_only: bool = False):
+        self.directory = directory
+        self.read_only = read_only
+        self.dim: Optional[int] = None
+        self._lock = threading.RLock()  # add() holds it while _open() takes the append lock
+        self._vector_fd = self._meta_fd = None
+        self._views = (None, None, 0)  # (vectors memmap, meta memmap, rows mapped)
+        self._index: Optional[IVFIndex] = None
+        self._index_mtime = None
+        self.searches = 0
+        self._search_seconds = 0.0
+        if os.path.exists(self._path("store.json")):
+            with open(self._path("store.json")) as f:
+                layout = json.load(f)
+            if layout.get("meta_itemsize") != META_DTYPE.itemsize:
+                raise ValueError(f"{directory} uses an older record layout; move it aside to start a new store")
+            self._open(layout["dim"])
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open(self, dim: int) -> None:
+        self.dim = dim
+        if self.read_only:
+            self._vector_fd = os.open(self._path("vectors.f32"), os.O_RDONLY)
+            self._meta_fd = os.open(self._path("meta.bin"), os.O_RDONLY)
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self._path("store.json")):
+            with open(self._path("store.json"), "w") as f:
+                json.dump({"dim": dim, "meta_itemsize": META_DTYPE.itemsize}, f)
+        flags = os.O_RDWR | os.O_APPEND | os.O_CREAT
+        self._vector_fd = os.open(self._path("vectors.f32"), flags, 0o644)
+        self._meta_fd = os.open(self._path("meta.bin"), flags, 0o644)
+        with self._append_lock():
+            self._repair()
+
+    @contextlib.contextmanager
+    def _append_lock(self):
+        """Exclusive across threads and the other worker processes sharing the files"""
+        with self._lock:
+            fcntl.flock(self._vector_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._vector_fd, fcntl.LOCK_UN)
+
+    def _committed_rows(self) -> int:
+        """Rows present in both files; another process may be halfway through appending one"""
+        if self.dim is None:
+            return 0
+        return min(
+            os.fstat(self._vector_fd).st_size // (self.dim * 4),
+            os.fstat(self._meta_fd).st_size // META_DTYPE.itemsize
+        )
+
+    def _repair(self) -> int:
+        """Drop a partially written last row left by a crashed writer; call with the append lock held"""
+        rows = self._committed_rows()
+        if os.fstat(self._vector_fd).st_size != rows * self.dim * 4:
+            os.ftruncate(self._vector_fd, rows * self.dim * 4)
+        if os.fstat(self._meta_fd).st_size != rows * META_DTYPE.itemsize:
+            os.ftruncate(self._meta_fd, rows * META_DTYPE.itemsize)
+        return rows
+
+    @property
+    def rows(self) -> int:
+        return self._committed_rows()
+
+    def add(self, embedding: np.ndarray, predicted_class: str, confidence: float, model_version: str) -> int:
+        """Append one case and return its case id"""
+        if self.read_only:
+            raise ValueError("The vector store was opened read-only")
+        version = model_version.encode()
+        if len(version) > META_DTYPE["model_version"].itemsize:
+            # A truncated version would never match model.version in same-version searches
+            raise ValueError(f"Model version {model_version!r} is longer than {META_DTYPE['model_version'].itemsize} bytes")
+        vector = _normalize(np.asarray(embedding, dtype=np.float32).reshape(-1))
+        record = np.array(
+            [(predicted_class.encode()[:48], confidence, version, time.time())], dtype=META_DTYPE
+        )
+        if self.dim is None:
+            with self._lock:
+                if self.dim is None:
+                    self._open(len(vector))
+        if len(vector) != self.dim:
+            raise ValueError(f"Embedding has {len(vector)} dimensions, store expects {self.dim}")
+        with self._append_lock():
+            # The file size, not a per-process counter, decides the id: other workers append too
+            case_id = self._repair()
+            os.write(self._vector_fd, vector.tobytes())
+            os.write(self._meta_fd, record.tobytes())
+        return case_id
+
+    def _mapped(self):
+        """Memmaps covering every committed row, remapped only when rows were appended"""
+        vectors, meta, mapped = self._views
+        rows = self._committed_rows()
+        if rows != mapped:
+            if rows == 0:
+                return None, None, 0
+            vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r", shape=(rows, self.dim))
+            meta = np.memmap(self._path("meta.bin"), dtype=META_DTYPE, mode="r", shape=(rows,))
+            self._views = (vectors, meta, rows)
+        return self._views
+
+    def _current_index(self) -> Optional[IVFIndex]:
+        """The IVF index on disk, reloaded whenever build-index replaced it"""
+        index_file = self._path(os.path.join("ivf", "index.json"))
+        try:
+            mtime = os.path.getmtime(index_file)
+        except OSError:
+            self._index = self._index_mtime = None
+            return None
+        if mtime != self._index_mtime:
+            self._index, self._index_mtime = IVFIndex.load(self._path("ivf")), mtime
+        return self._index
+
+    def case(self, case_id: int) -> Tuple[np.ndarray, dict]:
+        vectors, meta, rows = self._mapped()
+        if not 0 <= case_id < rows:
+            raise KeyError(case_id)
+        record = meta[case_id]
+        return np.array(vectors[case_id]), {
+            "case_id": int(case_id),
+            "predicted_class": record["predicted_class"].decode(),
+            "confidence": float(record["confidence"]),
+            "model_version": record["model_version"].decode(),
+            "created_at": float(record["created_at"]),
+        }
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 10,
+        model_version: Optional[str] = None,
+        exclude: Optional[int] = None,
+        nprobe: int = 8,
+        exact: bool = False
+    ) -> Tuple[List[Tuple[int, float]], str]:
+        """Top-k (case_id, cosine similarity) pairs and the search method used ("ivf" or "exact")"""
+        started = time.perf_counter()
+        vectors, meta, rows = self._mapped()
+        if rows == 0:
+            return [], "exact"
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(-1))
+        version = model_version.encode() if model_version is not None else None
+        index = None if exact else self._current_index()
+
+        # Candidate id ranges: IVF lists plus the rows appended after the index build, or everything
+        if index is not None and index.rows <= rows:
+            segments = [index.candidates(query, nprobe), np.arange(index.rows, rows)]
+            method = "ivf"
+        else:
+            segments = [np.arange(start, min(start + _SEARCH_CHUNK_ROWS, rows)) for start in range(0, rows, _SEARCH_CHUNK_ROWS)]
+            method = "exact"
+
+        best_ids, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        for ids in segments:
+            for start in range(0, len(ids), _SEARCH_CHUNK_ROWS):
+                chunk = ids[start:start + _SEARCH_CHUNK_ROWS]
+                if not len(chunk):
+                    continue
+                contiguous = chunk[-1] - chunk[0] + 1 == len(chunk)
+                rows_slice = slice(int(chunk[0]), int(chunk[-1]) + 1)
+                scores = (vectors[rows_slice] if contiguous else vectors[chunk]) @ query
+                keep = np.ones(len(chunk), dtype=bool)
+                if version is not None:
+                    keep &= (meta[rows_slice] if contiguous else meta[chunk])["model_version"] == version
+                if exclude is not None:
+                    keep &= chunk != exclude
+                chunk_ids, chunk_scores = _top_k(chunk[keep], scores[keep], k)
+                best_ids, best_scores = _top_k(
+                    np.concatenate([best_ids, chunk_ids]), np.concatenate([best_scores, chunk_scores]), k
+                )
+
+        self.searches += 1
+        self._search_seconds += time.perf_counter() - started
+        return [(int(i), float(s)) for i, s in zip(best_ids, best_scores)], method
+
+    def build_index(self, nlist: Optional[int] = None, iterations: int = 10, sample: int = 65536) -> IVFIndex:
+        """Build an IVF index over the current rows and atomically replace the previous one"""
+        vectors, _, rows = self._mapped()
+        if rows == 0:
+            raise ValueError("The vector store is empty")
+        index = IVFIndex.build(vectors, nlist or int(np.sqrt(rows)), iterations, sample)
+        staging = self._path("ivf.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        index.save(staging)
+        shutil.rmtree(self._path("ivf"), ignore_errors=True)
+        os.rename(staging, self._path("ivf"))
+        return index
+
+    def stats(self) -> dict:
+        index = self._current_index()
+        return {
+            "rows": self.rows,
+            "dim": self.dim,
+            "index": {"nlist": index.nlist, "rows": index.rows} if index is not None else None,
+            "searches": self.searches,
+            "avg_search_ms": self._search_seconds / self.searches * 1000.0 if self.searches else 0.0,
+        }
+
+
+def main():
+    from app.core.config import get_settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["stats", "build-index"])
+    parser.add_argument("--dir", default=get_settings().ML_EMBEDDINGS_DIR, help="Vector store directory")
+    parser.add_argument("--nlist", type=int, help="Number of IVF lists (default sqrt(rows))")
+    parser.add_argument("--iterations", type=int, default=10, help="k-means iterations")
+    parser.add_argument("--sample", type=int, default=65536, help="Rows used to train the centroids")
+    args = parser.parse_args()
+
+    store = VectorStore(args.dir, read_only=True)
+    if args.command == "build-index":
+        started = time.perf_counter()
+        index = store.build_index(args.nlist, args.iterations, args.sample)
+        print(f"Built IVF index over {index.rows} rows with {index.nlist} lists in {time.perf_counter() - started:.1f}s")
+    print(json.dumps(store.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Throughput and accuracy of the confidence cascade against the full model.
+
+Usage (from the backend directory):
+    python -m benchmarks.cascade --data-dir heldout/ --output bench_cascade.json
+
+--data-dir is a held-out set laid out as <class name>/<image>, with folder
+names matching the model's class names. Images are preprocessed once up
+front; both configurations then run over the same arrays in batches of
+--batch-size, so the numbers isolate model time. For every threshold the
+report gives accuracy, accuracy loss versus the full model, the share of
+images answered by the small model and the throughput gain.
+"""
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("ML_CASCADE_ENABLED", "true")
+
+import numpy as np
+
+from benchmarks.ml_pipeline import git_commit
+
+
+def load_heldout(data_dir: str, class_names, limit: int):
+    from app.ml.convert_tflite import find_images, load_images
+
+    index = {name: i for i, name in enumerate(class_names)}
+    paths, labels = [], []
+    for path in find_images(data_dir, limit):
+        label = os.path.basename(os.path.dirname(path))
+        if label in index:
+            paths.append(path)
+            labels.append(index[label])
+    if not paths:
+        raise SystemExit(f"No images under {data_dir} in folders named after the model's classes")
+    return load_images(paths), np.array(labels)
+
+
+def run_full(backend, images: np.ndarray, batch_size: int) -> np.ndarray:
+    return np.concatenate([
+        np.argmax(backend.predict(images[start:start + batch_size]), axis=1)
+        for start in range(0, len(images), batch_size)
+    ])
+
+
+def run_cascade(small, full, images: np.ndarray, batch_size: int, threshold: float):
+    """Small model on every batch; only images below threshold are re-run through the full model"""
+    predicted, answered_small = [], []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        probs = small.predict(batch)
+        top = np.argmax(probs, axis=1)
+        confident = np.max(probs, axis=1) >= threshold
+        if not confident.all():
+            top[~confident] = np.argmax(full.predict(batch[~confident]), axis=1)
+        predicted.append(top)
+        answered_small.append(confident)
+    return np.concatenate(predicted), np.concatenate(answered_small)
+
+
+def timed(fn, repeats: int):
+    fn()  # Warm up every shape this run uses
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", required=True, help="Held-out images in <class name>/ folders")
+    parser.add_argument("--version", help="Registry version to load (default ML_MODEL_VERSION)")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.7, 0.8, 0.9, 0.95, 0.99])
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--repeats", type=int, default=3, help="Timed passes over the held-out set")
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    from app.core.config import get_settings
+    from app.ml.registry import load_model_version
+
+    model = load_model_version(args.version or get_settings().ML_MODEL_VERSION)
+    if model.cascade is None:
+        raise SystemExit(f"Version {model.version} has no cascade model (see python -m app.ml.distill_cascade)")
+    images, labels = load_heldout(args.data_dir, model.class_names, args.samples)
+    print(f"{len(images)} held-out images, backend {model.backend.name}")
+
+    full_pred, full_seconds = timed(lambda: run_full(model.backend, images, args.batch_size), args.repeats)
+    full_accuracy = float((full_pred == labels).mean())
+    full_throughput = len(images) / full_seconds
+    print(f"full: accuracy {full_accuracy:.4f}, {full_throughput:.1f} img/s")
+
+    report = {
+        "commit": git_commit(),
+        "version": model.version,
+        "backend": model.backend.name,
+        "images": int(len(images)),
+        "batch_size": args.batch_size,
+        "full": {"accuracy": full_accuracy, "images_per_sec": full_throughput},
+        "cascade": [],
+    }
+    for threshold in args.thresholds:
+        (pred, answered_small), seconds = timed(
+            lambda: run_cascade(model.cascade, model.backend, images, args.batch_size, threshold), args.repeats
+        )
+        accuracy = float((pred == labels).mean())
+        entry = {
+            "threshold": threshold,
+            "accuracy": accuracy,
+            "accuracy_loss": full_accuracy - accuracy,
+            "answered_by_small": float(answered_small.mean()),
+            "agreement_with_full": float((pred == full_pred).mean()),
+            "images_per_sec": len(images) / seconds,
+            "speedup": full_seconds / seconds,
+        }
+        report["cascade"].append(entry)
+        print(
+            f"threshold {threshold}: accuracy {accuracy:.4f} (loss {entry['accuracy_loss']:+.4f}), "
+            f"small answered {entry['answered_by_small']:.0%}, {entry['images_per_sec']:.1f} img/s "
+            f"({entry['speedup']:.2f}x)"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
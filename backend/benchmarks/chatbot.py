@@ -0,0 +1,236 @@
+"""
+Throughput, timeouts and tail latency of the chatbot endpoints, offline.
+
+Usage (from the backend directory):
+    python -m benchmarks.chatbot --output bench_chat.json
+    python -m benchmarks.chatbot --latency-ms 1500 --error-rate 0.02 --concurrency 16 256
+    python -m benchmarks.chatbot --write-behind
+
+Runs POST /chatbot/chat (and /chatbot/chat/stream with --stream) through the
+ASGI app in-process against the local LLM stand-in (CHAT_LLM_PROVIDER=local),
+so no Gemini quota is used. The stand-in's latency distribution, token rate
+and error rate come from the flags below and its RNG is seeded, so runs are
+repeatable. Each request asks a distinct question so the semantic cache and
+prompt coalescing do not hide LLM latency. Conversations are written to a
+throwaway SQLite database unless --database-url is given. The user is loaded
+through a database session on every request, like the real auth dependency,
+so connections held across the LLM call show up in pool_checked_out_max.
+
+For every concurrency level the report gives requests/sec, p50/p95/p99
+latency (time to first delta as well when streaming), and the status codes
+seen, so timeouts (504) and provider errors (502) show up directly.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+
+def configure(args, database_dir: str) -> None:
+    """Settings are read at import time, so they are set before importing the app"""
+    os.environ["CHAT_LLM_PROVIDER"] = "local"
+    os.environ["CHAT_LOCAL_LLM_LATENCY_DISTRIBUTION"] = args.latency_distribution
+    os.environ["CHAT_LOCAL_LLM_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["CHAT_LOCAL_LLM_LATENCY_SIGMA"] = str(args.latency_sigma)
+    os.environ["CHAT_LOCAL_LLM_TOKENS_PER_SECOND"] = str(args.tokens_per_second)
+    os.environ["CHAT_LOCAL_LLM_ERROR_RATE"] = str(args.error_rate)
+    os.environ["CHAT_LOCAL_LLM_SEED"] = str(args.seed)
+    os.environ["CHAT_LLM_TIMEOUT_SECONDS"] = str(args.timeout)
+    os.environ["CHAT_LLM_MAX_CONCURRENCY"] = str(args.max_llm_concurrency)
+    os.environ["CHAT_SEMANTIC_CACHE_ENABLED"] = "false"
+    os.environ["CHAT_WRITE_BEHIND_ENABLED"] = "true" if args.write_behind else "false"
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(database_dir, 'bench.sqlite')}"
+    for name in ("GENAI_API_KEY", "SECRET_KEY", "JWT_SECRET_KEY"):
+        os.environ.setdefault(name, "benchmark")
+
+
+def build_app():
+    from fastapi import Depends, FastAPI
+    from app.auth.middleware import get_current_user_dependency, get_db
+    from app.chatbot import router as chatbot_router
+    from app.db.database import Base, SessionLocal, engine
+    from app.db.models import User
+
+    Base.metadata.create_all(engine)
+    db = SessionLocal()
+    user = db.query(User).filter(User.email == "bench@agricare.local").first()
+    if user is None:
+        user = User(email="bench@agricare.local", hashed_password="!")
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    user_id = user.id
+    db.close()
+
+    def bench_user(db=Depends(get_db)):
+        # Skips the token check but, like get_current_user, checks out a pooled connection
+        return db.get(User, user_id)
+
+    # In-process app with only the chatbot router; token verification is not what is measured
+    app = FastAPI()
+    app.include_router(chatbot_router.router, prefix="/chatbot")
+    app.dependency_overrides[get_current_user_dependency] = bench_user
+    return app, chatbot_router
+
+
+async def stream_request(app, path: str, body: dict):
+    """POST to the ASGI app directly, timestamping body chunks as they are sent
+    (httpx's ASGITransport buffers the whole response). Returns (status, first delta ms)."""
+    payload = json.dumps(body).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    request_sent, finished = False, asyncio.Event()
+    status, first_delta, started = None, None, time.perf_counter()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, first_delta
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            if first_delta is None and b'data: {"delta"' in chunk:
+                first_delta = (time.perf_counter() - started) * 1000.0
+            if b"event: error" in chunk:
+                # Failures after the 200 headers arrive as an error event
+                status = "error_event"
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return status, first_delta
+
+
+async def bench_level(app, client, concurrency: int, requests: int, stream: bool, offset: int) -> dict:
+    from benchmarks.ml_pipeline import percentiles
+    from app.db.database import engine
+
+    latencies, first_delta, statuses = [], [], Counter()
+    counter = iter(range(requests))
+    pool_checked_out_max = 0
+
+    async def sample_pool():
+        nonlocal pool_checked_out_max
+        while True:
+            pool_checked_out_max = max(pool_checked_out_max, engine.pool.checkedout())
+            await asyncio.sleep(0.005)
+
+    async def worker():
+        for i in counter:
+            body = {"message": f"Question {offset + i}: how often should I water my chili plants?"}
+            started = time.perf_counter()
+            if stream:
+                status, delta_ms = await stream_request(app, "/chatbot/chat/stream", body)
+                if delta_ms is not None:
+                    first_delta.append(delta_ms)
+            else:
+                response = await client.post("/chatbot/chat", json=body)
+                status = response.status_code
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            statuses[str(status)] += 1
+
+    sampler = asyncio.get_running_loop().create_task(sample_pool())
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    stats = percentiles(latencies)
+    stats.update(
+        concurrency=concurrency,
+        requests_per_sec=len(latencies) / elapsed,
+        statuses=dict(statuses),
+        pool_checked_out_max=pool_checked_out_max
+    )
+    if stream and first_delta:
+        stats["first_delta"] = percentiles(first_delta)
+    return stats
+
+
+async def run(args) -> dict:
+    import httpx
+    from benchmarks.ml_pipeline import git_commit
+
+    app, chatbot_router = build_app()
+    await chatbot_router.startup()
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "stream": args.stream,
+        "write_behind": args.write_behind,
+        "llm": {
+            "latency_distribution": args.latency_distribution,
+            "latency_ms": args.latency_ms,
+            "latency_sigma": args.latency_sigma,
+            "tokens_per_second": args.tokens_per_second,
+            "error_rate": args.error_rate,
+            "timeout_seconds": args.timeout,
+            "max_concurrency": args.max_llm_concurrency,
+        },
+        "levels": [],
+    }
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        for n, concurrency in enumerate(args.concurrency):
+            stats = await bench_level(app, client, concurrency, args.requests, args.stream, n * args.requests)
+            report["levels"].append(stats)
+            line = (
+                f"concurrency {concurrency}: {stats['requests_per_sec']:.1f} req/s, p50 {stats['p50_ms']:.0f}ms "
+                f"p95 {stats['p95_ms']:.0f}ms p99 {stats['p99_ms']:.0f}ms, "
+                f"{stats['pool_checked_out_max']} connections checked out at most"
+            )
+            if "first_delta" in stats:
+                line += f", first delta p50 {stats['first_delta']['p50_ms']:.0f}ms"
+            print(f"{line}, statuses {stats['statuses']}")
+    await chatbot_router.shutdown()
+    report["llm_stats"] = chatbot_router.llm.stats()
+    if chatbot_router.message_writer is not None:
+        report["write_behind_stats"] = chatbot_router.message_writer.stats()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    parser.add_argument("--requests", type=int, default=256, help="Requests per concurrency level")
+    parser.add_argument("--stream", action="store_true", help="Use the SSE endpoint")
+    parser.add_argument("--write-behind", action="store_true", help="Queue chat messages (CHAT_WRITE_BEHIND_ENABLED)")
+    parser.add_argument("--latency-distribution", default="lognormal",
+                        choices=["fixed", "uniform", "lognormal", "exponential"])
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="Median time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="CHAT_LLM_TIMEOUT_SECONDS")
+    parser.add_argument("--max-llm-concurrency", type=int, default=256, help="CHAT_LLM_MAX_CONCURRENCY")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", help="Default: a temporary SQLite database")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as database_dir:
+        configure(args, database_dir)
+        report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare Keras inference paths for the plant disease model.
+
+Usage (from the backend directory):
+    python -m benchmarks.keras_inference --batch-sizes 1 2 4 8 16 32 --iterations 30
+
+Measures, per batch size:
+  - model.predict(x)          (Keras data adapter + callbacks on every call)
+  - model(x, training=False)  (direct eager call)
+  - compiled                  (KerasBackend's fixed-signature tf.function, optionally --xla)
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.ml.backends import KerasBackend, configure_tf_threads
+
+
+def _time_ms(fn, x, iterations: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn(x)
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(x)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    p50 = float(np.percentile(timings, 50))
+    return {
+        "p50_ms": p50,
+        "p95_ms": float(np.percentile(timings, 95)),
+        "images_per_sec": x.shape[0] / (p50 / 1000.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="app/ml/models/plant_disease_model.h5")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--xla", action="store_true", help="XLA-compile the tf.function path")
+    parser.add_argument("--intra-op-threads", type=int, default=0)
+    parser.add_argument("--inter-op-threads", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    configure_tf_threads(args.intra_op_threads, args.inter_op_threads)
+    backend = KerasBackend.from_path(args.model, compiled=True, jit_compile=args.xla)
+    model = backend.model
+
+    paths = {
+        "model.predict": lambda x: model.predict(x, verbose=0),
+        "model(x)": lambda x: model(x, training=False).numpy(),
+        "compiled_xla" if args.xla else "compiled": backend.predict,
+    }
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(f"{'batch':>5}  {'path':<14} {'p50 ms':>9} {'p95 ms':>9} {'img/s':>9}")
+    for batch_size in args.batch_sizes:
+        x = rng.random((batch_size, 224, 224, 3), dtype=np.float32)
+        for name, fn in paths.items():
+            stats = _time_ms(fn, x, args.iterations)
+            results.append({"batch_size": batch_size, "path": name, **stats})
+            print(f"{batch_size:>5}  {name:<14} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['images_per_sec']:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "model": args.model,
+                "xla": args.xla,
+                "intra_op_threads": args.intra_op_threads,
+                "inter_op_threads": args.inter_op_threads,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Reproducible benchmark suite for the /ml/predict path.
+
+Usage (from the backend directory):
+    python -m benchmarks.ml_pipeline --output bench_ml.json
+    python -m benchmarks.ml_pipeline --quick
+
+Generates synthetic leaf-like JPEGs at several resolutions (seeded, so every
+run sees the same bytes) and reports:
+  - stages:     upload read, decode, resize, normalize, model forward and
+                response serialization, timed separately per resolution
+  - model:      backend forward pass at each batch size
+  - end_to_end: POST /ml/predict through the ASGI app in-process, for every
+                (max batch size, concurrency) combination
+
+Latencies are reported as p50/p95/p99 in ms alongside images/sec. The JSON
+output includes the git commit so runs can be compared between commits.
+The prediction cache is disabled so every request reaches the model.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault("ML_CACHE_ENABLED", "false")
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+RESOLUTIONS = [(256, 256), (1024, 768), (2048, 1536), (4032, 3024)]
+CONCURRENCY_LEVELS = [1, 4, 16, 64]
+BATCH_SIZES = [1, 4, 16, 32]
+
+
+def synthetic_leaf_jpeg(width: int, height: int, seed: int, quality: int = 90) -> bytes:
+    """A green leaf with vein lines and brown lesions on a soil-coloured background"""
+    rng = np.random.default_rng(seed)
+    background = rng.normal((110, 85, 60), 18, size=(height, width, 3)).clip(0, 255).astype(np.uint8)
+    img = Image.fromarray(background)
+    draw = ImageDraw.Draw(img)
+
+    cx, cy = width / 2, height / 2
+    rx, ry = width * rng.uniform(0.3, 0.45), height * rng.uniform(0.25, 0.4)
+    green = tuple(int(c) for c in rng.integers((40, 110, 30), (80, 170, 60)))
+    draw.ellipse([cx - rx, cy - ry, cx + rx, cy + ry], fill=green)
+    line_width = max(1, width // 300)
+    draw.line([cx - rx, cy, cx + rx, cy], fill=(150, 190, 110), width=line_width * 2)
+    for offset in np.linspace(-0.7, 0.7, 8):
+        x = cx + offset * rx
+        draw.line([x, cy, x + rx * 0.25, cy - ry * 0.6 * np.sign(offset or 1)], fill=(150, 190, 110), width=line_width)
+    for _ in range(int(rng.integers(5, 25))):
+        lx, ly = cx + rng.uniform(-0.7, 0.7) * rx, cy + rng.uniform(-0.6, 0.6) * ry
+        r = rng.uniform(0.01, 0.04) * width
+        draw.ellipse([lx - r, ly - r, lx + r, ly + r], fill=(110, 70, 30))
+
+    img = img.filter(ImageFilter.GaussianBlur(radius=max(1, width // 800)))
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def percentiles(samples_ms) -> dict:
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "count": int(samples.size),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def bench_stages(images_by_resolution: dict, backend, class_names, iterations: int) -> dict:
+    """Time each stage of a single prediction in isolation"""
+    from fastapi.responses import JSONResponse
+    from starlette.datastructures import UploadFile
+    from app.ml.preprocessing import preprocess_image
+    from app.ml.utils import decode_prediction
+
+    results = {}
+    for (width, height), images in images_by_resolution.items():
+        stages = {"upload_read": [], "decode": [], "resize": [], "normalize": [], "model": [], "serialize": []}
+        for i in range(iterations):
+            content = images[i % len(images)]
+
+            # Upload read: the same SpooledTemporaryFile the multipart parser produces
+            spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+            spooled.write(content)
+            spooled.seek(0)
+            upload = UploadFile(spooled, filename="leaf.jpg")
+            started = time.perf_counter()
+            data = await upload.read()
+            stages["upload_read"].append((time.perf_counter() - started) * 1000.0)
+            await upload.close()
+
+            img_array, timings = preprocess_image(data)
+            for stage in ("decode", "resize", "normalize"):
+                stages[stage].append(timings[stage])
+
+            started = time.perf_counter()
+            predictions = backend.predict(img_array[np.newaxis])
+            stages["model"].append((time.perf_counter() - started) * 1000.0)
+
+            predicted_class, confidence = decode_prediction(predictions[0], class_names)
+            started = time.perf_counter()
+            JSONResponse({
+                "predicted_class": predicted_class,
+                "confidence": float(confidence),
+                "model_version": "bench",
+                "success": True
+            }).body
+            stages["serialize"].append((time.perf_counter() - started) * 1000.0)
+
+        results[f"{width}x{height}"] = {
+            "jpeg_bytes": int(np.mean([len(c) for c in images])),
+            **{stage: percentiles(samples) for stage, samples in stages.items()},
+        }
+        print(f"stages {width}x{height}: " + ", ".join(
+            f"{stage} {results[f'{width}x{height}'][stage]['p50_ms']:.2f}ms" for stage in stages
+        ))
+    return results
+
+
+def bench_model(backend, batch_sizes, iterations: int) -> dict:
+    rng = np.random.default_rng(0)
+    results = {}
+    for batch_size in batch_sizes:
+        x = rng.random((batch_size, 224, 224, 3), dtype=np.float32)
+        backend.predict(x)  # Warm up this shape
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            backend.predict(x)
+            samples.append((time.perf_counter() - started) * 1000.0)
+        stats = percentiles(samples)
+        stats["images_per_sec"] = batch_size / (stats["p50_ms"] / 1000.0)
+        results[str(batch_size)] = stats
+        print(f"model batch {batch_size}: p50 {stats['p50_ms']:.2f}ms, {stats['images_per_sec']:.1f} img/s")
+    return results
+
+
+async def bench_end_to_end(app, images, batch_sizes, concurrency_levels, requests_per_level: int) -> list:
+    import httpx
+    from app.ml import router as ml_router
+    from app.ml.batching import MicroBatcher
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        for batch_size in batch_sizes:
+            # Swap in a batcher with this max batch size
+            await ml_router.batcher.stop()
+            ml_router.batcher = MicroBatcher(
+                max_batch_size=batch_size,
+                max_wait_ms=ml_router.settings.ML_MAX_BATCH_WAIT_MS,
+                executor=ml_router.ml_executor,
+                timings=ml_router.stage_timings
+            )
+            for concurrency in concurrency_levels:
+                latencies, errors = [], 0
+                counter = iter(range(requests_per_level))
+
+                async def worker():
+                    nonlocal errors
+                    for i in counter:
+                        content = images[i % len(images)]
+                        started = time.perf_counter()
+                        response = await client.post(
+                            "/ml/predict", files={"file": ("leaf.jpg", content, "image/jpeg")}
+                        )
+                        latencies.append((time.perf_counter() - started) * 1000.0)
+                        if response.status_code != 200:
+                            errors += 1
+
+                before = ml_router.batcher.stats()
+                started = time.perf_counter()
+                await asyncio.gather(*[worker() for _ in range(concurrency)])
+                elapsed = time.perf_counter() - started
+                after = ml_router.batcher.stats()
+                batches = after["total_batches"] - before["total_batches"]
+
+                stats = percentiles(latencies)
+                stats.update(
+                    max_batch_size=batch_size,
+                    concurrency=concurrency,
+                    errors=errors,
+                    images_per_sec=len(latencies) / elapsed,
+                    avg_batch_size=(after["total_requests"] - before["total_requests"]) / batches if batches else 0.0,
+                )
+                results.append(stats)
+                print(
+                    f"e2e batch<={batch_size} concurrency {concurrency}: p50 {stats['p50_ms']:.1f}ms "
+                    f"p95 {stats['p95_ms']:.1f}ms p99 {stats['p99_ms']:.1f}ms, {stats['images_per_sec']:.1f} img/s"
+                )
+    return results
+
+
+async def run(args) -> dict:
+    from fastapi import FastAPI
+    from app.ml import router as ml_router
+    from app.ml.lifecycle import model_lifecycle
+
+    resolutions = RESOLUTIONS[:2] if args.quick else RESOLUTIONS
+    images_by_resolution = {
+        (w, h): [synthetic_leaf_jpeg(w, h, seed) for seed in range(args.images_per_resolution)]
+        for w, h in resolutions
+    }
+
+    # In-process app with only the ML router, so no database or LLM credentials are needed
+    app = FastAPI()
+    app.include_router(ml_router.router, prefix="/ml")
+    await model_lifecycle.wait_ready()
+    if not model_lifecycle.ready:
+        raise SystemExit(f"Model failed to load: {model_lifecycle.error}")
+    model = model_lifecycle.registry.active
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "backend": model.backend.name,
+        "model_version": model.version,
+        "stages": await bench_stages(images_by_resolution, model.backend, model.class_names, args.iterations),
+        "model": bench_model(model.backend, args.batch_sizes, args.iterations),
+    }
+
+    e2e_images = images_by_resolution[resolutions[-1 if args.e2e_resolution == "largest" else 1]]
+    report["end_to_end"] = await bench_end_to_end(
+        app, e2e_images, args.batch_sizes, args.concurrency, args.requests
+    )
+    await ml_router.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--quick", action="store_true", help="Fewer resolutions, iterations and levels")
+    parser.add_argument("--iterations", type=int, default=30, help="Samples per stage/model measurement")
+    parser.add_argument("--images-per-resolution", type=int, default=8)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY_LEVELS)
+    parser.add_argument("--requests", type=int, default=128, help="Requests per end-to-end level")
+    parser.add_argument("--e2e-resolution", choices=["typical", "largest"], default="typical")
+    args = parser.parse_args()
+    if args.quick:
+        args.iterations = min(args.iterations, 10)
+        args.batch_sizes = args.batch_sizes[:2]
+        args.concurrency = args.concurrency[:2]
+        args.requests = min(args.requests, 32)
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
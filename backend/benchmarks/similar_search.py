@@ -0,0 +1,101 @@
+"""
+Latency and recall of /ml/similar's vector search at scale.
+
+Usage (from the backend directory):
+    python -m benchmarks.similar_search --rows 1000000 --output bench_similar.json
+
+Fills a temporary VectorStore with clustered synthetic 128-d embeddings
+(seeded), then times exact top-k search and IVF search for each --nprobe.
+IVF recall@k is measured against the exact results for the same queries.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from app.ml.vectors import META_DTYPE, VectorStore
+from benchmarks.ml_pipeline import git_commit, percentiles
+
+
+def fill_store(store: VectorStore, rows: int, dim: int, clusters: int, seed: int = 0) -> VectorStore:
+    """Write rows straight to the store files in bulk, as if appended one by one"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    store.add(centres[0], "seed", 1.0, "bench")  # Creates the store with the right dimension
+    chunk = 100000
+    for start in range(1, rows, chunk):
+        count = min(chunk, rows - start)
+        vectors = centres[rng.integers(0, clusters, count)] + rng.normal(scale=0.5, size=(count, dim))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        meta = np.zeros(count, dtype=META_DTYPE)
+        meta["predicted_class"], meta["confidence"], meta["model_version"] = b"bench", 1.0, b"bench"
+        with open(store._path("vectors.f32"), "ab") as f:
+            f.write(vectors.astype(np.float32).tobytes())
+        with open(store._path("meta.bin"), "ab") as f:
+            f.write(meta.tobytes())
+    # Reopen so the row count is read back from disk
+    return VectorStore(store.directory)
+
+
+def time_search(store: VectorStore, queries, k: int, **kwargs):
+    results, samples = [], []
+    for query in queries:
+        started = time.perf_counter()
+        neighbours, method = store.search(query, k, **kwargs)
+        samples.append((time.perf_counter() - started) * 1000.0)
+        results.append({case_id for case_id, _ in neighbours})
+    return results, percentiles(samples), method
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--clusters", type=int, default=200, help="Synthetic cluster centres")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, help="IVF lists (default sqrt(rows))")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = fill_store(VectorStore(directory), args.rows, args.dim, args.clusters)
+        print(f"{store.rows} rows x {store.dim} dims")
+        vectors, _, _ = store._mapped()
+        rng = np.random.default_rng(1)
+        queries = [np.array(vectors[i]) for i in rng.integers(0, store.rows, args.queries)]
+
+        exact, exact_stats, _ = time_search(store, queries, args.k, exact=True)
+        print(f"exact: p50 {exact_stats['p50_ms']:.1f}ms p95 {exact_stats['p95_ms']:.1f}ms")
+
+        started = time.perf_counter()
+        index = store.build_index(args.nlist)
+        build_seconds = time.perf_counter() - started
+        print(f"IVF index: {index.nlist} lists built in {build_seconds:.1f}s")
+
+        report = {
+            "commit": git_commit(),
+            "rows": store.rows,
+            "dim": store.dim,
+            "k": args.k,
+            "exact": exact_stats,
+            "ivf": {"nlist": index.nlist, "build_seconds": build_seconds, "nprobe": []},
+        }
+        for nprobe in args.nprobe:
+            approximate, stats, _ = time_search(store, queries, args.k, nprobe=nprobe)
+            stats["nprobe"] = nprobe
+            stats["recall_at_k"] = float(np.mean([len(a & e) / len(e) for a, e in zip(approximate, exact)]))
+            report["ivf"]["nprobe"].append(stats)
+            print(f"ivf nprobe {nprobe}: p50 {stats['p50_ms']:.2f}ms p95 {stats['p95_ms']:.2f}ms, recall {stats['recall_at_k']:.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
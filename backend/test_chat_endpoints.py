@@ -82,7 +82,7 @@ def test_prediction_chat():
         headers=headers,
         json={
             "crop": "tomato",
-            "disease": "blight"
+            "disease": "late blight"
         }
     )
     
@@ -99,7 +99,7 @@ def test_prediction_chat():
             headers=headers,
             json={
                 "crop": "tomato",
-                "disease": "blight",
+                "disease": "late blight",
                 "conversation_id": conversation_id,
                 "follow_up_message": "What are the early symptoms I should look for?"
             }
@@ -117,7 +117,7 @@ def test_prediction_chat():
                 headers=headers,
                 json={
                     "crop": "tomato",
-                    "disease": "blight",
+                    "disease": "late blight",
                     "conversation_id": conversation_id,
                     "follow_up_message": "Can you recommend some organic treatments?"
                 }
@@ -140,8 +140,8 @@ def get_conversations():
     response = requests.get(f"{BASE_URL}/chatbot/conversations", headers=headers)
     
     if response.status_code == 200:
-        conversations = response.json()
-        print(f"Found {len(conversations)} conversations:")
+        conversations = response.json()["conversations"]
+        print(f"Found {len(conversations)} conversations (first page):")
         for conv in conversations:
             print(f"- ID: {conv['id']}, Type: {conv['conversation_type']}, Messages: {len(conv['messages'])}")
             if conv['crop'] and conv['disease']:
@@ -149,6 +149,24 @@ def get_conversations():
     else:
         print(f"Error: {response.status_code} - {response.text}")
 
+def test_advice_catalog_lookup():
+    """Check that the documented prediction payloads find their precomputed advice (no server needed)"""
+    from app.chatbot.catalog import AdviceCatalog
+
+    print("\n=== Testing Advice Catalog Lookup ===")
+    catalog = AdviceCatalog({
+        ("Tomato_Late_blight", "en"): "Late blight advice",
+        ("Pepper__bell___Bacterial_spot", "en"): "Bacterial spot advice",
+    })
+    assert catalog.get("tomato", "late blight", "en") == "Late blight advice"
+    assert catalog.get("Tomato", "Tomato_Late_blight", "en") == "Late blight advice"
+    assert catalog.get("bell pepper", "bacterial spot", "en") == "Bacterial spot advice"
+    assert catalog.get("Pepper__bell", "Pepper__bell___Bacterial_spot", "en") == "Bacterial spot advice"
+    # Early or late blight: left to the LLM
+    assert catalog.get("tomato", "blight", "en") is None
+    assert catalog.get("tomato", "late blight", "si") is None
+    print("Catalog lookups OK")
+
 if __name__ == "__main__":
     print("Chat Endpoint Testing Guide")
     print("=" * 50)
@@ -160,6 +178,7 @@ if __name__ == "__main__":
     print("\n" + "=" * 50)
     
     # Uncomment the functions you want to test
+    test_advice_catalog_lookup()
     test_general_chat()
     test_prediction_chat()
     get_conversations() 
\ No newline at end of file